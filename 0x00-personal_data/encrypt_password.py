@@ -1,13 +1,62 @@
 #!/usr/bin/env python3
 """ Module for the password encryptor
 """
+from functools import lru_cache
+import logging
+import os
+import time
 import bcrypt
 
 
+BCRYPT_ROUNDS_FLOOR = 10
+logger = logging.getLogger(__name__)
+
+
+def calibrate_rounds(target_ms: float = 250,
+                     min_rounds: int = BCRYPT_ROUNDS_FLOOR,
+                     max_rounds: int = 16) -> int:
+    """ Find the highest bcrypt work factor hashing within `target_ms`
+    milliseconds on this host, never below `min_rounds`
+    """
+    rounds = min_rounds
+    while rounds < max_rounds:
+        start = time.perf_counter()
+        bcrypt.hashpw(b'calibration', bcrypt.gensalt(rounds))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        # every extra round doubles the hashing time
+        if elapsed_ms * 2 > target_ms:
+            break
+        rounds += 1
+    return rounds
+
+
+@lru_cache(maxsize=None)
+def bcrypt_rounds() -> int:
+    """ Work factor of new hashes: BCRYPT_ROUNDS, or calibrated once
+    against BCRYPT_TARGET_MS and at least BCRYPT_MIN_ROUNDS, never
+    below 10
+    """
+    if os.getenv('BCRYPT_ROUNDS'):
+        # an explicit setting only has to clear the floor
+        min_rounds = BCRYPT_ROUNDS_FLOOR
+        rounds = int(os.getenv('BCRYPT_ROUNDS'))
+    else:
+        min_rounds = max(BCRYPT_ROUNDS_FLOOR,
+                         int(os.getenv('BCRYPT_MIN_ROUNDS', '10')))
+        rounds = calibrate_rounds(
+            float(os.getenv('BCRYPT_TARGET_MS', '250')), min_rounds)
+    if rounds < min_rounds:
+        logger.warning('bcrypt work factor %d raised to the minimum %d',
+                       rounds, min_rounds)
+        rounds = min_rounds
+    logger.info('bcrypt work factor: %d', rounds)
+    return rounds
+
+
 def hash_password(password: str) -> bytes:
     """ Hash a password argument and salt it
     """
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(bcrypt_rounds()))
 
 
 def is_valid(hashed_password: bytes, password: str) -> bool:
@@ -16,6 +65,16 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
     return bcrypt.checkpw(password.encode(), hashed_password)
 
 
+def needs_rehash(hashed_password: bytes) -> bool:
+    """ Check if a hash uses a lower work factor than new hashes
+    """
+    try:
+        rounds = int(hashed_password.split(b'$')[2])
+    except (IndexError, ValueError):
+        return True
+    return rounds < bcrypt_rounds()
+
+
 if __name__ == '__main__':
     password = "MyAmazingPassw0rd"
     print(hash_password(password))
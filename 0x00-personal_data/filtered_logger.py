@@ -1,19 +1,40 @@
 #!/usr/bin/env python3
 """ Module for the filtered logger
 """
-from typing import List
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+from queue import Empty, Full, Queue
+from threading import Condition
+from typing import Callable, Iterator, List, Pattern, Sequence, Tuple
+import argparse
+import atexit
 import logging
+import mmap
+import random
 import re
 import os
+import sys
+import time
 import mysql.connector.connection
 
 
+@lru_cache(maxsize=128)
+def _redaction_pattern(fields: Tuple[str, ...], separator: str) -> Pattern:
+    """ Compile the pattern matching the values of some fields
+    """
+    return re.compile(r'({})=(.*?){}'.format(
+        '|'.join(map(re.escape, fields)), re.escape(separator)))
+
+
 def filter_datum(fields: List[str], redaction: str,
                  message: str, separator: str) -> str:
     """ Filter selecten data fields from a message
     """
-    return re.sub(r'({})=(.*?){}'.format('|'.join(fields), separator),
-                  r'\1={}{}'.format(redaction, separator), message)
+    return _redaction_pattern(tuple(fields), separator).sub(
+        r'\1={}{}'.format(redaction, separator), message)
 
 
 class RedactingFormatter(logging.Formatter):
@@ -28,33 +49,252 @@ class RedactingFormatter(logging.Formatter):
         """
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self._spacing = re.compile(r'=(.*?){}'.format(
+            re.escape(self.SEPARATOR)))
+        self._spaced = r'=\1{} '.format(self.SEPARATOR)
 
     def format(self, record: logging.LogRecord) -> str:
         """ Redact the selected fields from the LogRecord
         """
-        redacted_message = re.sub(r'=(.*?);', r'=\1; ', filter_datum(
+        # redaction stays a pass of its own: in a single alternation the
+        # spacing branch would swallow fields nested in another value
+        redacted_message = self._spacing.sub(self._spaced, filter_datum(
             self.fields, self.REDACTION, record.getMessage(), self.SEPARATOR))
         setattr(record, 'asctime', self.formatTime(record))
         setattr(record, 'message', redacted_message.strip())
-        return self.FORMAT % record.__dict__
+        return self.formatMessage(record)
 
 
 # user_data = [line for line in csv.reader(open("user_data.csv"))]
 PII_FIELDS = ('name', 'email', 'phone', 'ssn', 'password')
 
 
-def get_logger() -> logging.Logger:
+class BoundedQueueHandler(QueueHandler):
+    """ Queue handler with a bounded queue and an overflow policy:
+        - 'block': wait for room in the queue
+        - 'drop_oldest': discard the oldest queued record
+        - 'drop': discard the new record
+    Discarded records are counted in `dropped`.
+    """
+    OVERFLOW_POLICIES = ('block', 'drop_oldest', 'drop')
+
+    def __init__(self, queue: Queue, overflow: str = 'block'):
+        """ Initialise the queue and the overflow policy
+        """
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy {overflow}')
+        super(BoundedQueueHandler, self).__init__(queue)
+        self.overflow = overflow
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """ Queue the record as is, the listener thread formats it
+        """
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """ Queue a record following the overflow policy
+        """
+        if self.overflow == 'block':
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+            return
+        except Full:
+            pass
+        if self.overflow == 'drop_oldest':
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                pass
+            try:
+                self.queue.put_nowait(record)
+            except Full:
+                pass
+        self.dropped += 1
+
+
+class DrainingQueueListener(QueueListener):
+    """ Queue listener that waits for room to queue its stop sentinel, so
+    the bounded queue is drained on shutdown
+    """
+
+    def enqueue_sentinel(self) -> None:
+        """ Queue the stop sentinel after the pending records
+        """
+        self.queue.put(self._sentinel)
+
+
+def get_logger(queued: bool = False, queue_size: int = 10000,
+               overflow: str = 'block') -> logging.Logger:
     """ Create a 'Logger' object with the RedactingFormatter stream handler
+
+    When queued, the logger only puts records on a bounded queue and a
+    QueueListener thread redacts and writes them.
     """
     logger = logging.Logger("user_data", logging.INFO)
     stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(RedactingFormatter(list(PII_FIELDS)))
-    logger.addHandler(stream_handler)
+    if not queued:
+        logger.addHandler(stream_handler)
+        return logger
+
+    queue_handler = BoundedQueueHandler(Queue(queue_size), overflow)
+    queue_handler.listener = DrainingQueueListener(queue_handler.queue,
+                                                   stream_handler)
+    queue_handler.listener.start()
+    atexit.register(queue_handler.listener.stop)
+    logger.addHandler(queue_handler)
     return logger
 
 
-def get_db() -> mysql.connector.connection.MySQLConnection:
-    """ Create a 'MySQLConnection' object from environment variables
+def connect_with_backoff(connect: Callable, errors: tuple = (Exception,),
+                         deadline: float = 30.0, base_delay: float = 0.1,
+                         max_delay: float = 5.0):
+    """ Call `connect` until it succeeds, sleeping between attempts with
+    an exponential backoff and full jitter, the last error is raised once
+    `deadline` seconds have passed
+    """
+    start = time.monotonic()
+    attempt = 0
+    while True:
+        try:
+            return connect()
+        except errors:
+            remaining = deadline - (time.monotonic() - start)
+            if remaining <= 0:
+                raise
+            delay = random.uniform(0, min(max_delay,
+                                          base_delay * 2 ** attempt))
+            time.sleep(min(delay, remaining))
+            attempt += 1
+
+
+class ConnectionPool:
+    """ Pool of DB-API connections, checked with `is_healthy` on checkout
+    and (re)opened through `connect_with_backoff`
+    """
+
+    def __init__(self, connect: Callable, min_size: int = 1,
+                 max_size: int = 5, is_healthy: Callable = None,
+                 errors: tuple = (Exception,), deadline: float = 30.0):
+        """ Initialise the pool and open its first `min_size` connections
+        """
+        if max_size < 1 or min_size > max_size:
+            raise ValueError('Invalid pool size')
+        self._connect_fn = connect
+        self._is_healthy = is_healthy or (lambda con: True)
+        self._errors = errors
+        self.deadline = deadline
+        self.max_size = max_size
+        self._idle = deque()
+        self._size = 0
+        self._cond = Condition()
+        for _ in range(min_size):
+            self._idle.append(self._connect())
+            self._size += 1
+
+    def _connect(self):
+        """ Open a new connection
+        """
+        return connect_with_backoff(self._connect_fn, self._errors,
+                                    self.deadline)
+
+    @staticmethod
+    def _close(con) -> None:
+        """ Close a connection, ignoring errors of dead ones
+        """
+        try:
+            con.close()
+        except Exception:
+            pass
+
+    def acquire(self, timeout: float = None):
+        """ Check out a healthy connection, waiting at most `timeout`
+        seconds when all `max_size` connections are in use
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while len(self._idle) == 0 and self._size >= self.max_size:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError('No connection available')
+                self._cond.wait(remaining)
+            con = self._idle.pop() if len(self._idle) > 0 else None
+            if con is None:
+                self._size += 1
+        if con is not None:
+            try:
+                if self._is_healthy(con):
+                    return con
+            except Exception:
+                pass
+            self._close(con)
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, con, discard: bool = False) -> None:
+        """ Give back a checked out connection, or drop it if `discard`
+
+        The connection is rolled back first, ending its transaction (and
+        the read snapshot of a SELECT), and dropped if that fails.
+        """
+        if not discard:
+            discard = not self._rollback(con)
+        with self._cond:
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append(con)
+            self._cond.notify()
+        if discard:
+            self._close(con)
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """ Context manager checking out and giving back a connection
+        """
+        con = self.acquire(timeout)
+        discard = False
+        try:
+            yield con
+        except self._errors:
+            discard = True
+            raise
+        finally:
+            self.release(con, discard)
+
+    @staticmethod
+    def _rollback(con) -> bool:
+        """ Roll back the transaction of a connection, False if it failed
+        """
+        try:
+            con.rollback()
+            return True
+        except Exception:
+            return False
+
+    def close(self) -> None:
+        """ Close all the idle connections
+        """
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+        for con in idle:
+            self._close(con)
+
+
+def _connect_db() -> mysql.connector.connection.MySQLConnection:
+    """ Open a 'MySQLConnection' from environment variables
     """
     config = {
         'user': os.getenv('PERSONAL_DATA_DB_USERNAME', 'root'),
@@ -62,34 +302,163 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
         'host': os.getenv('PERSONAL_DATA_DB_HOST', 'localhost'),
         'database': os.getenv('PERSONAL_DATA_DB_NAME')
     }
-    con = None
-    while con is None:
-        try:
-            con = mysql.connector.connection.MySQLConnection(**config)
-        except mysql.connector.Error as e:
-            print(e.with_traceback(None))
-    return con
+    return mysql.connector.connection.MySQLConnection(**config)
 
 
-def main():
-    """ The main entry point for the program
+def _db_deadline() -> float:
+    """ Seconds to keep retrying to connect, from the environment
+    """
+    try:
+        return float(os.getenv('PERSONAL_DATA_DB_CONNECT_DEADLINE', '30'))
+    except ValueError:
+        return 30.0
+
+
+def get_db() -> mysql.connector.connection.MySQLConnection:
+    """ Create a 'MySQLConnection' object from environment variables
+    """
+    return connect_with_backoff(_connect_db, (mysql.connector.Error,),
+                                _db_deadline())
+
+
+_pool = None
+
+
+def get_pool() -> ConnectionPool:
+    """ Shared pool of 'MySQLConnection' objects, sized from environment
+    variables
+    """
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(
+            _connect_db,
+            int(os.getenv('PERSONAL_DATA_DB_POOL_MIN', '1')),
+            int(os.getenv('PERSONAL_DATA_DB_POOL_MAX', '5')),
+            is_healthy=lambda con: con.is_connected(),
+            errors=(mysql.connector.Error,),
+            deadline=_db_deadline())
+    return _pool
+
+
+def stream_rows(cursor, batch_size: int = 1000) -> Iterator[Tuple]:
+    """ Yield the rows of an executed DB-API cursor, fetched by batches
+    """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def log_rows(cursor, logger: logging.Logger, batch_size: int = 1000) -> None:
+    """ Log the rows of an executed DB-API cursor as they are fetched
     """
-    con = get_db()
-    while not con.is_connected():
-        con.connect()
-    cur = con.cursor()
-    cur.execute('SHOW COLUMNS FROM users;')
-    colnames = next(zip(*cur.fetchall()))
-
-    cur.execute('SELECT * FROM users;')
-    rows = cur.fetchall()
-    logger = get_logger()
-    for row in rows:
+    colnames = [column[0] for column in cursor.description]
+    for row in stream_rows(cursor, batch_size):
         msg = ''.join([f'{k}={v};' for k, v in (zip(colnames, row))])
         logger.info(msg)
 
 
+def main(batch_size: int = 1000):
+    """ The main entry point for the program
+    """
+    with get_pool().connection() as con:
+        # unbuffered: rows are streamed from the server as they are fetched
+        cur = con.cursor(buffered=False)
+        cur.execute('SELECT * FROM users;')
+        log_rows(cur, get_logger(), batch_size)
+        cur.close()
+
+
+def _chunk_bounds(file_path: str, chunk_size: int) -> List[Tuple[int, int]]:
+    """ Split a file into line-aligned (start, end) byte ranges
+    """
+    size = os.path.getsize(file_path)
+    if size == 0:
+        return []
+    bounds = []
+    with open(file_path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            end = mm.find(b'\n', min(start + chunk_size, size) - 1)
+            end = size if end == -1 else end + 1
+            bounds.append((start, end))
+            start = end
+    return bounds
+
+
+def _redact_chunk(task: Tuple[str, int, int, Tuple[str, ...], str, str]
+                  ) -> bytes:
+    """ Redact one byte range of a log file, run in a worker process
+    """
+    file_path, start, end, fields, redaction, separator = task
+    with open(file_path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode('utf-8', 'surrogateescape')
+    return filter_datum(fields, redaction, text, separator).encode(
+        'utf-8', 'surrogateescape')
+
+
+def redact_file(in_path: str, out_path: str,
+                fields: Sequence[str] = PII_FIELDS,
+                redaction: str = RedactingFormatter.REDACTION,
+                separator: str = RedactingFormatter.SEPARATOR,
+                workers: int = None,
+                chunk_size: int = 8 * 1024 * 1024) -> None:
+    """ Redact a 'key=value;' log file in parallel, keeping the line order
+
+    At most two chunks per worker are in flight, so memory stays bounded
+    whatever the size of the file.
+    """
+    if chunk_size <= 0:
+        raise ValueError(f'Invalid chunk size {chunk_size}')
+    workers = workers or os.cpu_count() or 1
+    pending = deque()
+    with ProcessPoolExecutor(workers) as pool, open(out_path, 'wb') as out:
+        for start, end in _chunk_bounds(in_path, chunk_size):
+            pending.append(pool.submit(
+                _redact_chunk,
+                (in_path, start, end, tuple(fields), redaction, separator)))
+            if len(pending) >= 2 * workers:
+                out.write(pending.popleft().result())
+        while len(pending) > 0:
+            out.write(pending.popleft().result())
+
+
+def _positive_int(value: str) -> int:
+    """ argparse type of the strictly positive integer options
+    """
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f'{value} is not a positive integer')
+    return number
+
+
+def cli(argv: List[str]) -> int:
+    """ Command line entry point: redact a log file
+    """
+    parser = argparse.ArgumentParser(
+        prog='filtered_logger.py',
+        description='Redact PII fields from a key=value; log file')
+    parser.add_argument('input', help='log file to redact')
+    parser.add_argument('output', help='redacted log file to write')
+    parser.add_argument('-f', '--fields', default=','.join(PII_FIELDS),
+                        help='comma separated fields to redact')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='worker processes (default: CPU count)')
+    parser.add_argument('-c', '--chunk-size', type=_positive_int,
+                        default=8 * 1024 * 1024,
+                        help='approximate bytes per chunk')
+    args = parser.parse_args(argv)
+    redact_file(args.input, args.output, args.fields.split(','),
+                workers=args.workers, chunk_size=args.chunk_size)
+    return 0
+
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(cli(sys.argv[1:]))
     # main()
     fields = ["password", "date_of_birth"]
     messages = ["name=egg;email=eggmin@eggsample.com;password=eggcellent;"
@@ -108,6 +477,11 @@ if __name__ == '__main__':
     formatter = RedactingFormatter(fields=["email", "ssn", "password"])
     print(formatter.format(log_record))
 
+    # a field nested in the value of another one is still redacted
+    log_record.msg = "note=password=hunter2;email=a@b.c;"
+    assert formatter.format(log_record).endswith(
+        "note=password=***; email=***;"), "nested field leaked"
+
     #############################################################
 
     # db = get_db()
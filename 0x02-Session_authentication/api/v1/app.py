@@ -4,6 +4,7 @@ Route module for the API
 """
 from os import getenv
 from api.v1.views import app_views
+from api.v1.auth.auth import PathMatcher
 from flask import Flask, jsonify, abort, request
 from flask_cors import CORS
 
@@ -14,6 +15,12 @@ CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
 auth = None
 
 AUTH_TYPE = getenv('AUTH_TYPE')
+EXCLUDED_PATHS = PathMatcher([
+    '/api/v1/status/',
+    '/api/v1/unauthorized/',
+    '/api/v1/forbidden/',
+    '/api/v1/auth_session/login/'
+])
 
 if AUTH_TYPE is not None:
     if AUTH_TYPE == 'auth':
@@ -31,6 +38,9 @@ if AUTH_TYPE is not None:
     elif AUTH_TYPE == 'session_db_auth':
         from api.v1.auth.session_db_auth import SessionDBAuth
         auth = SessionDBAuth()
+    elif AUTH_TYPE == 'session_token_auth':
+        from api.v1.auth.session_token_auth import SessionTokenAuth
+        auth = SessionTokenAuth()
 
     @app.before_request
     def auth_handler():
@@ -38,21 +48,17 @@ if AUTH_TYPE is not None:
         """
         if auth is None:
             return
-        if not auth.require_auth(request.path, [
-            '/api/v1/status/',
-            '/api/v1/unauthorized/',
-            '/api/v1/forbidden/',
-            '/api/v1/auth_session/login/'
-        ]):
+        if not auth.require_auth(request.path, EXCLUDED_PATHS):
             return
         if (
             auth.authorization_header(request) is None and
             auth.session_cookie(request) is None
         ):
             abort(401)
-        if auth.current_user(request) is None:
+        ctx = auth.context(request)
+        if ctx.user is None:
             abort(403)
-        request.current_user = auth.current_user(request)
+        request.current_user = ctx.user
 
 
 @app.errorhandler(404)
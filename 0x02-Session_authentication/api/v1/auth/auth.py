@@ -1,25 +1,121 @@
 #!/usr/bin/env python3
 """ Module of the Base of Authentication mechanisms
 """
-from typing import List, TypeVar
+from functools import lru_cache
+from typing import Callable, Iterable, List, Tuple, TypeVar, Union
 from os import getenv
+import re
+
+
+class PathMatcher:
+    """ Excluded paths compiled once into:
+        - a set of exact paths, insensitive to a trailing slash
+        - a trie of 'prefix*' rules and one of reversed '*suffix' rules
+        - a regex of '*infix*' rules
+    so that matching a path doesn't depend on the number of rules
+    """
+    END = ''
+
+    def __init__(self, paths: Iterable[str]):
+        """ Compile the exclusion rules
+        """
+        self._exact = set()
+        self._prefixes = {}
+        self._suffixes = {}
+        infixes = []
+        for rule in paths:
+            if len(rule) > 1 and rule.startswith('*') and rule.endswith('*'):
+                infixes.append(rule[1:-1])
+            elif rule.endswith('*'):
+                self._insert(self._prefixes, rule[:-1])
+            elif rule.startswith('*'):
+                self._insert(self._suffixes, rule[1:].rstrip('/')[::-1])
+            else:
+                self._exact.add(rule.rstrip('/'))
+        self._infixes = None
+        if len(infixes) > 0:
+            self._infixes = re.compile('|'.join(map(re.escape, infixes)))
+
+    @classmethod
+    def _insert(cls, trie: dict, chars: str):
+        """ Add a string to a trie
+        """
+        for char in chars:
+            trie = trie.setdefault(char, {})
+        trie[cls.END] = True
+
+    @classmethod
+    def _walk(cls, trie: dict, chars: Iterable[str]) -> bool:
+        """ Check if a trie holds a prefix of some characters
+        """
+        for char in chars:
+            if cls.END in trie:
+                return True
+            trie = trie.get(char)
+            if trie is None:
+                return False
+        return cls.END in trie
+
+    def match(self, path: str) -> bool:
+        """ Check if a path is excluded
+        """
+        stripped = path.rstrip('/')
+        if stripped in self._exact:
+            return True
+        if self._walk(self._prefixes, path):
+            return True
+        if self._walk(self._suffixes, reversed(stripped)):
+            return True
+        return (self._infixes is not None and
+                self._infixes.search(path) is not None)
+
+
+@lru_cache(maxsize=32)
+def _compile_paths(paths: Tuple[str, ...]) -> PathMatcher:
+    """ Compile (and cache) a list of excluded paths
+    """
+    return PathMatcher(paths)
+
+
+class AuthContext:
+    """ Authentication state of one request, each value is resolved at
+    most once and shared by the before-request hook and the views
+    """
+    def __init__(self, auth: 'Auth', request=None):
+        """ Initialise an unresolved context for a request
+        """
+        self.auth = auth
+        self.request = request
+        self._values = {}
+
+    def resolve(self, name: str, resolver: Callable):
+        """ Get a value of the context, calling `resolver` the first time
+        """
+        if name not in self._values:
+            self._values[name] = resolver()
+        return self._values[name]
+
+    @property
+    def user(self) -> TypeVar('User'):
+        """ The authenticated user of the request
+        """
+        return self.resolve(
+            'user', lambda: self.auth.current_user(self.request))
 
 
 class Auth:
     """ Base authentication manager class
     """
-    def require_auth(self, path: str, excluded_paths: List[str]) -> bool:
-        """ Check if a path requires authentication
+    def require_auth(self, path: str,
+                     excluded_paths: Union[List[str], PathMatcher]) -> bool:
+        """ Check if a path requires authentication, `excluded_paths` can
+        be given already compiled as a PathMatcher
         """
         if path is None or excluded_paths is None:
             return True
-        if path in excluded_paths or path + '/' in excluded_paths:
-            return False
-        for expath in excluded_paths:
-            if ((expath.endswith('*') or expath.startswith('*')) and
-                    path.find(expath.strip('*')) != -1):
-                return False
-        return True
+        if not isinstance(excluded_paths, PathMatcher):
+            excluded_paths = _compile_paths(tuple(excluded_paths))
+        return not excluded_paths.match(path)
 
     def authorization_header(self, request=None) -> str:
         """ Extract the 'Authorization' header
@@ -35,6 +131,18 @@ class Auth:
         """
         return None
 
+    def context(self, request=None) -> AuthContext:
+        """ Get the authentication context of a request, created once per
+        request
+        """
+        if request is None:
+            return AuthContext(self)
+        ctx = getattr(request, 'auth_context', None)
+        if ctx is None or ctx.auth is not self:
+            ctx = AuthContext(self, request)
+            request.auth_context = ctx
+        return ctx
+
     def session_cookie(self, request=None):
         """ Get the the cookie value of a request
         """
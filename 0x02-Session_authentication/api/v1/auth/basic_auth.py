@@ -1,14 +1,68 @@
 #!/usr/bin/env python3
 """ Module of a Basic Authentication class
 """
+from collections import OrderedDict
+from hashlib import sha256
+from os import getenv, urandom
+from threading import Lock
 from typing import Tuple, TypeVar
+import hmac
+import time
 from api.v1.views.users import User
 from api.v1.auth.auth import Auth
 
 
 class BasicAuth(Auth):
     """ Basic authentication manager class
+
+    Verified Authorization headers are cached (LRU, with a TTL) by a keyed
+    digest, mapped to the user id and the password hash they were checked
+    against. A hit is only used while the user still exists with the same
+    password hash, so password changes and removals invalidate it.
     """
+    def __init__(self):
+        """ Initialise the verified credential cache
+        """
+        self.cache_size = int(getenv('BASIC_AUTH_CACHE_SIZE', '1024'))
+        self.cache_ttl = float(getenv('BASIC_AUTH_CACHE_TTL', '60'))
+        self._cache = OrderedDict()
+        self._cache_lock = Lock()
+        self._cache_key = urandom(32)
+
+    def _cache_digest(self, authorization_header: str) -> bytes:
+        """ Keyed digest of an Authorization header, used as cache key
+        """
+        return hmac.new(self._cache_key, authorization_header.encode(),
+                        sha256).digest()
+
+    def cached_user(self, digest: bytes) -> TypeVar('User'):
+        """ Get the user of a cached header digest, if still valid
+        """
+        with self._cache_lock:
+            entry = self._cache.get(digest)
+            if entry is None:
+                return None
+            self._cache.move_to_end(digest)
+        user_id, password, expires_at = entry
+        user = None
+        if expires_at > time.monotonic():
+            user = User.get(user_id)
+        if user is None or user.password != password:
+            with self._cache_lock:
+                self._cache.pop(digest, None)
+            return None
+        return user
+
+    def cache_user(self, digest: bytes, user: TypeVar('User')):
+        """ Cache the user verified for a header digest
+        """
+        with self._cache_lock:
+            self._cache[digest] = (user.id, user.password,
+                                   time.monotonic() + self.cache_ttl)
+            self._cache.move_to_end(digest)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
     def extract_base64_authorization_header(
             self,
             authorization_header: str
@@ -78,10 +132,19 @@ class BasicAuth(Auth):
         if request is None:
             return None
         auth_header = self.authorization_header(request)
+        if auth_header is None or self.cache_size <= 0:
+            digest = None
+        else:
+            digest = self._cache_digest(auth_header)
+            user = self.cached_user(digest)
+            if user is not None:
+                return user
         b64_header = self.extract_base64_authorization_header(auth_header)
         header_data = self.decode_base64_authorization_header(b64_header)
         user_email, user_pwd = self.extract_user_credentials(header_data)
         user = self.user_object_from_credentials(user_email, user_pwd)
+        if user is not None and digest is not None:
+            self.cache_user(digest, user)
         return user
 
 
@@ -4,13 +4,14 @@
 from typing import TypeVar
 import uuid
 from api.v1.auth.auth import Auth
+from api.v1.auth.session_table import session_table
 from api.v1.views.users import User
 
 
 class SessionAuth(Auth):
     """ Session authentication manager class
     """
-    user_id_by_session_id = {}
+    user_id_by_session_id = session_table()
 
     def create_session(self, user_id: str = None) -> str:
         """ Create a session id associated with a user id
@@ -28,10 +29,18 @@ class SessionAuth(Auth):
             return None
         return SessionAuth.user_id_by_session_id.get(session_id)
 
+    def session_user_id(self, request=None) -> str:
+        """ Get the user id of the session cookie of a request, looked up
+        once per request
+        """
+        return self.context(request).resolve(
+            'user_id',
+            lambda: self.user_id_for_session_id(self.session_cookie(request)))
+
     def current_user(self, request=None) -> TypeVar('User'):
         """ Get the current user
         """
-        user_id = self.user_id_for_session_id(self.session_cookie(request))
+        user_id = self.session_user_id(request)
         if user_id is None:
             return None
         return User.get(user_id)
@@ -47,7 +56,7 @@ class SessionAuth(Auth):
         session_id = self.session_cookie(request)
         if session_id is None:
             return False
-        if self.user_id_for_session_id(session_id) is None:
+        if self.session_user_id(request) is None:
             return False
         self.user_id_by_session_id.pop(session_id)
         return True
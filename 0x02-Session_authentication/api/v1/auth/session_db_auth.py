@@ -2,16 +2,35 @@
 """ Module of a Session Authentication with Expiry class
 """
 from typing import TypeVar
-from datetime import datetime, timedelta
-import uuid
+from datetime import datetime
 from os import getenv
+from time import monotonic
 from api.v1.auth.session_exp_auth import SessionExpAuth
 from models.user_session import UserSession
 
 
 class SessionDBAuth(SessionExpAuth):
     """ Session authentication & expiry with DB manager class
+
+    The in-memory session table is used as a read-through cache of the
+    UserSession objects, which are found through their session_id index.
+    Unless the table is shared by the processes (SESSION_STORE=sqlite),
+    a cached session is checked again in the database after
+    SESSION_DB_CACHE_TTL seconds, as another process may have destroyed it.
     """
+    def __init__(self):
+        """ Initialise the instance with a session duration and cache TTL
+        """
+        super().__init__()
+        self.cache_ttl = float(getenv('SESSION_DB_CACHE_TTL', '1'))
+
+    def _mark_checked(self, session_id: str):
+        """ Trust a cached session for `cache_ttl` more seconds
+        """
+        session_dict = SessionDBAuth.user_id_by_session_id.get(session_id)
+        if isinstance(session_dict, dict):
+            session_dict['checked_until'] = monotonic() + self.cache_ttl
+
     def create_session(self, user_id=None) -> str:
         """ Create a session id associated with a user id and create time
         """
@@ -19,6 +38,8 @@ class SessionDBAuth(SessionExpAuth):
         if session_id is None:
             return None
         UserSession(user_id=user_id, session_id=session_id).save()
+        if not hasattr(SessionDBAuth.user_id_by_session_id, 'expire'):
+            self._mark_checked(session_id)
         return session_id
 
     def user_id_for_session_id(self, session_id=None) -> str:
@@ -26,20 +47,39 @@ class SessionDBAuth(SessionExpAuth):
         """
         if session_id is None:
             return None
+        sessions = SessionDBAuth.user_id_by_session_id
+        shared = hasattr(sessions, 'expire')
+        user_id = super().user_id_for_session_id(session_id)
+        if user_id is not None:
+            if shared:
+                return user_id
+            session_dict = sessions.get(session_id)
+            if (isinstance(session_dict, dict) and
+                    session_dict.get('checked_until', 0) > monotonic()):
+                return user_id
 
         user_sessions = UserSession.search({'session_id': session_id})
         if len(user_sessions) == 0:
+            # destroyed, possibly by another process
+            sessions.pop(session_id, None)
             return None
+        if user_id is not None:
+            self._mark_checked(session_id)
+            return user_id
         session = user_sessions[0]
 
-        if self.session_duration <= 0:
-            return getattr(session, 'created_at', None)
-        if getattr(session, 'created_at', None) is None:
-            return None
-        if session.created_at + timedelta(
-            seconds=self.session_duration
-        ) < datetime.now():
-            return None
+        created_at = getattr(session, 'created_at', None)
+        age = 0
+        if self.session_duration > 0:
+            if created_at is None:
+                return None
+            age = (datetime.utcnow() - created_at).total_seconds()
+            if age > self.session_duration:
+                session.remove()
+                return None
+        self.store_session(session_id, session.user_id, created_at, age)
+        if not shared:
+            self._mark_checked(session_id)
         return getattr(session, 'user_id', None)
 
     def destroy_session(self, request=None) -> bool:
@@ -53,11 +93,12 @@ class SessionDBAuth(SessionExpAuth):
         session_id = self.session_cookie(request)
         if session_id is None:
             return False
-        user_id = self.user_id_for_session_id()
-        if user_id is None:
+        if self.session_user_id(request) is None:
             return False
-        user_sessions = UserSession.search({'user_id': user_id})
+        self.user_id_by_session_id.pop(session_id, None)
+        user_sessions = UserSession.search({'session_id': session_id})
         if len(user_sessions) == 0:
             return False
-        user_sessions[0].remove()
+        for session in user_sessions:
+            session.remove()
         return True
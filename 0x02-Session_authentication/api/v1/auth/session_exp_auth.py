@@ -1,14 +1,27 @@
 #!/usr/bin/env python3
 """ Module of a Session Authentication with Expiry class
 """
-from datetime import datetime, timedelta
+from datetime import datetime
 from os import getenv
+from threading import Lock
+from time import monotonic
+import heapq
 from api.v1.auth.session_auth import SessionAuth
 
 
 class SessionExpAuth(SessionAuth):
     """ Session authentication & expiry manager class
+
+    Expiry times are kept in a min-heap, so expired sessions are swept a
+    few at a time on every create/lookup, in O(log n) each, instead of
+    staying in memory until looked up again. They are read from the clock
+    of the session table: monotonic in memory, wall clock in a shared
+    store that outlives the process.
     """
+    expiry_heap = []
+    expiry_lock = Lock()
+    SWEEP_BUDGET = 16
+
     def __init__(self):
         """ Initialise the instance with a session duration
         """
@@ -17,16 +30,67 @@ class SessionExpAuth(SessionAuth):
         except Exception:
             self.session_duration = 0
 
+    def sweep(self, budget: int = None) -> int:
+        """ Remove up to `budget` expired sessions, return how many
+        """
+        if budget is None:
+            budget = self.SWEEP_BUDGET
+        heap = SessionExpAuth.expiry_heap
+        sessions = SessionExpAuth.user_id_by_session_id
+        now = self.now()
+        if hasattr(sessions, 'expire'):
+            # shared store, indexed on expires_at
+            return sessions.expire(now, budget)
+        removed = 0
+        with SessionExpAuth.expiry_lock:
+            while len(heap) > 0 and heap[0][0] <= now and removed < budget:
+                expires_at, session_id = heapq.heappop(heap)
+                session_dict = sessions.get(session_id)
+                # skip entries of sessions destroyed or created again
+                if (isinstance(session_dict, dict) and
+                        session_dict.get('expires_at') == expires_at):
+                    sessions.pop(session_id, None)
+                    removed += 1
+            if len(heap) > 2 * len(sessions) + self.SWEEP_BUDGET:
+                # mostly entries of destroyed sessions, drop them
+                heap[:] = [entry for entry in heap
+                           if entry[1] in sessions]
+                heapq.heapify(heap)
+        return removed
+
+    @staticmethod
+    def now() -> float:
+        """ Current time on the clock of the session table
+        """
+        return getattr(SessionExpAuth.user_id_by_session_id, 'clock',
+                       monotonic)()
+
+    def store_session(self, session_id: str, user_id: str,
+                      created_at: datetime = None, age: float = 0):
+        """ Keep a session in memory, expiring `age` seconds early
+        """
+        expires_at = None
+        if self.session_duration > 0:
+            expires_at = self.now() + self.session_duration - age
+        SessionExpAuth.user_id_by_session_id[session_id] = {
+            'user_id': user_id,
+            'created_at': created_at or datetime.now(),
+            'expires_at': expires_at
+        }
+        if (expires_at is not None and
+                not hasattr(SessionExpAuth.user_id_by_session_id, 'expire')):
+            with SessionExpAuth.expiry_lock:
+                heapq.heappush(SessionExpAuth.expiry_heap,
+                               (expires_at, session_id))
+
     def create_session(self, user_id=None):
         """ Create a session id associated with a user id and create time
         """
         session_id = super().create_session(user_id)
         if session_id is None:
             return None
-        SessionExpAuth.user_id_by_session_id[session_id] = {
-            'user_id': user_id,
-            'created_at': datetime.now()
-        }
+        self.sweep()
+        self.store_session(session_id, user_id)
         return session_id
 
     def user_id_for_session_id(self, session_id=None):
@@ -34,15 +98,15 @@ class SessionExpAuth(SessionAuth):
         """
         if session_id is None:
             return None
+        self.sweep()
         session_dict = SessionExpAuth.user_id_by_session_id.get(session_id)
         if session_dict is None:
             return None
         if self.session_duration <= 0:
             return session_dict['user_id']
-        if session_dict.get('created_at') is None:
+        if session_dict.get('expires_at') is None:
             return None
-        if session_dict['created_at'] + timedelta(
-            seconds=self.session_duration
-        ) < datetime.now():
+        if session_dict['expires_at'] < self.now():
+            SessionExpAuth.user_id_by_session_id.pop(session_id, None)
             return None
         return session_dict['user_id']
@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+""" Module of a bounded session table
+"""
+from collections import OrderedDict
+from datetime import datetime
+from os import getenv
+from threading import RLock, local
+from time import monotonic
+import heapq
+import json
+import os
+import sqlite3
+import time
+
+
+class SessionTable:
+    """ Mapping of session ids to sessions, evicting the least recently
+    used sessions beyond `max_sessions` in total or `max_per_user` for
+    a single user (0 means no limit)
+
+    Values are either a user id or a dict with a 'user_id' key.
+    """
+    clock = staticmethod(monotonic)
+
+    def __init__(self, max_sessions: int = None, max_per_user: int = None):
+        """ Initialise the limits, from environment variables by default
+        """
+        if max_sessions is None:
+            max_sessions = int(getenv('SESSION_MAX_COUNT', '100000'))
+        if max_per_user is None:
+            max_per_user = int(getenv('SESSION_MAX_PER_USER', '100'))
+        self.max_sessions = max_sessions
+        self.max_per_user = max_per_user
+        self.evictions = 0
+        self.user_evictions = 0
+        self._sessions = OrderedDict()
+        self._by_user = {}
+        self._lock = RLock()
+
+    @staticmethod
+    def _user_id(value) -> str:
+        """ User id of a session value
+        """
+        if isinstance(value, dict):
+            return value.get('user_id')
+        return value
+
+    def _discard(self, session_id: str):
+        """ Remove a session, return its value or None
+        """
+        value = self._sessions.pop(session_id, None)
+        if value is None:
+            return None
+        user_id = self._user_id(value)
+        user_sessions = self._by_user.get(user_id)
+        if user_sessions is not None:
+            user_sessions.pop(session_id, None)
+            if len(user_sessions) == 0:
+                del self._by_user[user_id]
+        return value
+
+    def __setitem__(self, session_id: str, value):
+        """ Add or replace a session, evicting the oldest ones if needed
+        """
+        with self._lock:
+            self._discard(session_id)
+            user_id = self._user_id(value)
+            self._sessions[session_id] = value
+            user_sessions = self._by_user.setdefault(user_id, OrderedDict())
+            user_sessions[session_id] = None
+            while 0 < self.max_per_user < len(user_sessions):
+                self._discard(next(iter(user_sessions)))
+                self.user_evictions += 1
+            while 0 < self.max_sessions < len(self._sessions):
+                self._discard(next(iter(self._sessions)))
+                self.evictions += 1
+
+    def __getitem__(self, session_id: str):
+        """ Get a session, marking it as recently used
+        """
+        value = self.get(session_id)
+        if value is None:
+            raise KeyError(session_id)
+        return value
+
+    def get(self, session_id: str, default=None):
+        """ Get a session, marking it as recently used
+        """
+        with self._lock:
+            value = self._sessions.get(session_id)
+            if value is None:
+                return default
+            self._sessions.move_to_end(session_id)
+            self._by_user[self._user_id(value)].move_to_end(session_id)
+            return value
+
+    def pop(self, session_id: str, *default):
+        """ Remove a session and return it
+        """
+        with self._lock:
+            value = self._discard(session_id)
+        if value is None:
+            if len(default) > 0:
+                return default[0]
+            raise KeyError(session_id)
+        return value
+
+    def user_sessions(self, user_id: str) -> list:
+        """ Session ids of a user, oldest first
+        """
+        with self._lock:
+            return list(self._by_user.get(user_id, ()))
+
+    def clear(self):
+        """ Remove all sessions
+        """
+        with self._lock:
+            self._sessions.clear()
+            self._by_user.clear()
+
+    def stats(self) -> dict:
+        """ Sizes and eviction counters of the table
+        """
+        return {
+            'sessions': len(self._sessions),
+            'users': len(self._by_user),
+            'evictions': self.evictions,
+            'user_evictions': self.user_evictions
+        }
+
+    def __contains__(self, session_id) -> bool:
+        return session_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __iter__(self):
+        return iter(list(self._sessions))
+
+
+class SQLiteSessionTable:
+    """ Session table shared by all the processes of a host through a
+    SQLite database in WAL mode, with a short-lived in-process read cache
+
+    Same interface and limits as SessionTable, except that the sessions
+    evicted first are the oldest created rather than the least recently
+    used, so that lookups never write. Expiry times are stored on the wall
+    clock, which, unlike the monotonic one, survives reboots. Connections
+    are opened per thread and process, so a forked worker opens its own.
+    """
+    clock = staticmethod(time.time)
+
+    def __init__(self, path: str = None, max_sessions: int = None,
+                 max_per_user: int = None, cache_ttl: float = None):
+        """ Initialise the database path, limits and cache from environment
+        variables by default
+        """
+        if path is None:
+            path = getenv('SESSION_STORE_PATH', '.sessions.sqlite3')
+        if max_sessions is None:
+            max_sessions = int(getenv('SESSION_MAX_COUNT', '100000'))
+        if max_per_user is None:
+            max_per_user = int(getenv('SESSION_MAX_PER_USER', '100'))
+        if cache_ttl is None:
+            cache_ttl = float(getenv('SESSION_STORE_CACHE_TTL', '1'))
+        self.path = path
+        self.max_sessions = max_sessions
+        self.max_per_user = max_per_user
+        self.cache_ttl = cache_ttl
+        self.evictions = 0
+        self.user_evictions = 0
+        self._cache = {}
+        self._local = local()
+        self._schema_pid = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """ Connection of the current thread, opened in this process
+        """
+        pid = os.getpid()
+        con = getattr(self._local, 'connection', None)
+        if con is None or self._local.pid != pid:
+            # a connection inherited through fork must not be used
+            con = sqlite3.connect(self.path, timeout=5)
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = con
+            self._local.pid = pid
+            if self._schema_pid != pid:
+                self._create_schema(con)
+                self._schema_pid = pid
+        return con
+
+    @staticmethod
+    def _create_schema(con: sqlite3.Connection):
+        """ Create the tables, indexes and triggers if needed
+        """
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            con.execute('CREATE TABLE IF NOT EXISTS sessions '
+                        '(session_id TEXT PRIMARY KEY, user_id TEXT, '
+                        'expires_at REAL, data TEXT)')
+            con.execute('CREATE INDEX IF NOT EXISTS ix_sessions_user_id '
+                        'ON sessions (user_id)')
+            con.execute('CREATE INDEX IF NOT EXISTS ix_sessions_expires_at '
+                        'ON sessions (expires_at)')
+            # row count kept by triggers, COUNT(*) would scan the table
+            con.execute('CREATE TABLE IF NOT EXISTS sessions_count '
+                        '(id INTEGER PRIMARY KEY CHECK (id = 0), '
+                        'total INTEGER NOT NULL)')
+            con.execute('INSERT OR IGNORE INTO sessions_count '
+                        'SELECT 0, COUNT(*) FROM sessions')
+            con.execute('CREATE TRIGGER IF NOT EXISTS sessions_insert '
+                        'AFTER INSERT ON sessions BEGIN UPDATE '
+                        'sessions_count SET total = total + 1; END')
+            con.execute('CREATE TRIGGER IF NOT EXISTS sessions_delete '
+                        'AFTER DELETE ON sessions BEGIN UPDATE '
+                        'sessions_count SET total = total - 1; END')
+            con.commit()
+        except BaseException:
+            con.rollback()
+            raise
+
+    @staticmethod
+    def _dumps(value) -> str:
+        """ Serialize a session value
+        """
+        if not isinstance(value, dict):
+            return None
+        data = dict(value)
+        if isinstance(data.get('created_at'), datetime):
+            data['created_at'] = data['created_at'].isoformat()
+        return json.dumps(data)
+
+    @staticmethod
+    def _loads(user_id: str, data: str):
+        """ Deserialize a session value
+        """
+        if data is None:
+            return user_id
+        value = json.loads(data)
+        if value.get('created_at') is not None:
+            value['created_at'] = datetime.fromisoformat(value['created_at'])
+        return value
+
+    def _evict(self, con: sqlite3.Connection, query: str, args=()) -> int:
+        """ Delete the sessions selected by a query, return how many
+        """
+        rows = con.execute(query, args).fetchall()
+        con.executemany('DELETE FROM sessions WHERE session_id = ?', rows)
+        for row in rows:
+            self._cache.pop(row[0], None)
+        return len(rows)
+
+    def __setitem__(self, session_id: str, value):
+        """ Add or replace a session, evicting the oldest ones if needed
+        """
+        user_id = SessionTable._user_id(value)
+        expires_at = value.get('expires_at') \
+            if isinstance(value, dict) else None
+        self._cache.pop(session_id, None)
+        with self.connection as con:
+            # no REPLACE: its implicit delete wouldn't fire the trigger
+            con.execute('DELETE FROM sessions WHERE session_id = ?',
+                        (session_id,))
+            con.execute('INSERT INTO sessions '
+                        '(session_id, user_id, expires_at, data) '
+                        'VALUES (?, ?, ?, ?)',
+                        (session_id, user_id, expires_at,
+                         self._dumps(value)))
+            if self.max_per_user > 0:
+                # bounded by the per-user cap, through the user_id index
+                count = con.execute(
+                    'SELECT COUNT(*) FROM sessions WHERE user_id = ?',
+                    (user_id,)).fetchone()[0]
+                if count > self.max_per_user:
+                    self.user_evictions += self._evict(
+                        con, 'SELECT session_id FROM sessions '
+                        'WHERE user_id = ? ORDER BY rowid LIMIT ?',
+                        (user_id, count - self.max_per_user))
+            if self.max_sessions > 0:
+                count = self._count(con)
+                if count > self.max_sessions:
+                    self.evictions += self._evict(
+                        con, 'SELECT session_id FROM sessions '
+                        'ORDER BY rowid LIMIT ?',
+                        (count - self.max_sessions,))
+
+    @staticmethod
+    def _count(con: sqlite3.Connection) -> int:
+        """ Number of sessions, from the trigger maintained counter
+        """
+        return con.execute(
+            'SELECT total FROM sessions_count WHERE id = 0').fetchone()[0]
+
+    def __getitem__(self, session_id: str):
+        """ Get a session
+        """
+        value = self.get(session_id)
+        if value is None:
+            raise KeyError(session_id)
+        return value
+
+    def get(self, session_id: str, default=None):
+        """ Get a session, from the cache if looked up recently
+        """
+        now = monotonic()
+        cached = self._cache.get(session_id)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        row = self.connection.execute(
+            'SELECT user_id, data FROM sessions WHERE session_id = ?',
+            (session_id,)).fetchone()
+        if row is None:
+            self._cache.pop(session_id, None)
+            return default
+        value = self._loads(*row)
+        if self.cache_ttl > 0:
+            if len(self._cache) >= 10000:
+                self._cache.clear()
+            self._cache[session_id] = (now + self.cache_ttl, value)
+        return value
+
+    def pop(self, session_id: str, *default):
+        """ Remove a session and return it
+        """
+        self._cache.pop(session_id, None)
+        with self.connection as con:
+            row = con.execute(
+                'SELECT user_id, data FROM sessions WHERE session_id = ?',
+                (session_id,)).fetchone()
+            con.execute('DELETE FROM sessions WHERE session_id = ?',
+                        (session_id,))
+        if row is None:
+            if len(default) > 0:
+                return default[0]
+            raise KeyError(session_id)
+        return self._loads(*row)
+
+    def expire(self, now: float, limit: int) -> int:
+        """ Remove at most `limit` sessions expired at `now`, return how many
+        """
+        with self.connection as con:
+            return self._evict(
+                con, 'SELECT session_id FROM sessions WHERE expires_at <= ? '
+                'ORDER BY expires_at LIMIT ?', (now, limit))
+
+    def user_sessions(self, user_id: str) -> list:
+        """ Session ids of a user, oldest first
+        """
+        return [row[0] for row in self.connection.execute(
+            'SELECT session_id FROM sessions WHERE user_id = ? '
+            'ORDER BY rowid', (user_id,))]
+
+    def clear(self):
+        """ Remove all sessions
+        """
+        self._cache.clear()
+        with self.connection as con:
+            con.execute('DELETE FROM sessions')
+
+    def stats(self) -> dict:
+        """ Sizes and eviction counters of the table
+        """
+        con = self.connection
+        return {
+            'sessions': self._count(con),
+            'users': con.execute('SELECT COUNT(DISTINCT user_id) '
+                                 'FROM sessions').fetchone()[0],
+            'evictions': self.evictions,
+            'user_evictions': self.user_evictions
+        }
+
+    def __contains__(self, session_id) -> bool:
+        return self.get(session_id) is not None
+
+    def __len__(self) -> int:
+        return self._count(self.connection)
+
+    def __iter__(self):
+        return iter([row[0] for row in self.connection.execute(
+            'SELECT session_id FROM sessions ORDER BY rowid')])
+
+
+def session_table():
+    """ Session table selected by the SESSION_STORE environment variable:
+    `sqlite` to share the sessions between processes, in memory otherwise
+    """
+    if getenv('SESSION_STORE') == 'sqlite':
+        return SQLiteSessionTable()
+    return SessionTable()
+
+
+class RevocationList:
+    """ Revoked token ids of this process, each kept until its token
+    expires (wall clock), expired ones swept a few at a time
+    """
+    SWEEP_BUDGET = 16
+
+    def __init__(self):
+        """ Initialise the revoked ids and their expiry heap
+        """
+        self._revoked = {}
+        self._heap = []
+        self._lock = RLock()
+
+    def add(self, token_id: str, expires_at: float):
+        """ Revoke a token until it expires
+        """
+        with self._lock:
+            self._revoked[token_id] = expires_at
+            heapq.heappush(self._heap, (expires_at, token_id))
+            self.expire(time.time(), self.SWEEP_BUDGET)
+
+    def expire(self, now: float, limit: int) -> int:
+        """ Forget at most `limit` tokens expired at `now`
+        """
+        removed = 0
+        with self._lock:
+            while (len(self._heap) > 0 and self._heap[0][0] <= now and
+                   removed < limit):
+                expires_at, token_id = heapq.heappop(self._heap)
+                if self._revoked.get(token_id) == expires_at:
+                    del self._revoked[token_id]
+                    removed += 1
+        return removed
+
+    def __contains__(self, token_id) -> bool:
+        return token_id in self._revoked
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+
+class SQLiteRevocationList(RevocationList):
+    """ Revoked token ids shared by all the processes of a host, stored in
+    a SQLiteSessionTable without any cap so that no revocation is dropped
+    before its token expires
+    """
+
+    def __init__(self, path: str = None):
+        """ Initialise the table, SESSION_TOKEN_REVOKED_PATH by default
+        """
+        if path is None:
+            path = getenv('SESSION_TOKEN_REVOKED_PATH',
+                          '.revoked_tokens.sqlite3')
+        self._table = SQLiteSessionTable(path, 0, 0)
+
+    def add(self, token_id: str, expires_at: float):
+        """ Revoke a token until it expires
+        """
+        self._table[token_id] = {'user_id': None, 'expires_at': expires_at}
+        self.expire(time.time(), self.SWEEP_BUDGET)
+
+    def expire(self, now: float, limit: int) -> int:
+        """ Forget at most `limit` tokens expired at `now`
+        """
+        return self._table.expire(now, limit)
+
+    def __contains__(self, token_id) -> bool:
+        return token_id in self._table
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+
+def revocation_list():
+    """ Revocation list selected by the SESSION_STORE environment variable:
+    `sqlite` to share it between processes, in memory otherwise
+    """
+    if getenv('SESSION_STORE') == 'sqlite':
+        return SQLiteRevocationList()
+    return RevocationList()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+""" Module of a Signed Token Session Authentication class
+"""
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from hashlib import sha256
+from os import getenv, urandom
+import hmac
+import logging
+import time
+from api.v1.auth.session_auth import SessionAuth
+from api.v1.auth.session_table import revocation_list
+
+
+class SessionTokenAuth(SessionAuth):
+    """ Stateless session authentication manager class
+
+    The session cookie is a token `kid.user_id.iat.exp.nonce.signature`
+    signed with HMAC-SHA256, so it is validated without any session
+    store. Keys come from SESSION_TOKEN_KEYS (`kid:secret,...`): the
+    first one signs, all of them verify, which allows rotating keys.
+    Tokens always expire, after SESSION_DURATION seconds or a day.
+    Logged out tokens are kept in a revocation list until they expire:
+    per process, or shared by the processes of a host with
+    SESSION_STORE=sqlite (hosts don't share it).
+    """
+    DEFAULT_DURATION = 86400
+
+    def __init__(self):
+        """ Initialise the signing keys, duration and revocation list
+        """
+        try:
+            self.session_duration = int(getenv('SESSION_DURATION'))
+        except Exception:
+            self.session_duration = 0
+        if self.session_duration <= 0:
+            self.session_duration = self.DEFAULT_DURATION
+        self.keys = {}
+        for entry in getenv('SESSION_TOKEN_KEYS', '').split(','):
+            kid, _, secret = entry.strip().partition(':')
+            if kid and secret:
+                self.keys.setdefault(kid, secret.encode())
+        if len(self.keys) == 0:
+            logging.getLogger(__name__).warning(
+                'SESSION_TOKEN_KEYS is not set: session tokens are signed '
+                'with a random key, only valid in this process until it '
+                'restarts')
+            self.keys['0'] = urandom(32)
+        self.signing_kid = next(iter(self.keys))
+        self.revoked = revocation_list()
+
+    @staticmethod
+    def _encode(value: str) -> str:
+        """ Base64 (URL safe, unpadded) encoding of a string
+        """
+        return urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def _decode(value: str) -> str:
+        """ Decode a string encoded by _encode
+        """
+        return urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode()
+
+    def _signature(self, kid: str, payload: str) -> str:
+        """ Signature of a token payload with a key
+        """
+        digest = hmac.new(self.keys[kid], payload.encode(), sha256).digest()
+        return urlsafe_b64encode(digest).decode().rstrip('=')
+
+    def create_session(self, user_id: str = None) -> str:
+        """ Create a signed token carrying a user id
+        """
+        if user_id is None or type(user_id) is not str:
+            return None
+        iat = int(time.time())
+        exp = iat + self.session_duration
+        payload = '.'.join((self.signing_kid, self._encode(user_id),
+                            str(iat), str(exp), urandom(8).hex()))
+        return payload + '.' + self._signature(self.signing_kid, payload)
+
+    def verify_token(self, token: str) -> tuple:
+        """ Check a token, return (user_id, exp, nonce) or None
+        """
+        if token is None or type(token) is not str or not token.isascii():
+            return None
+        payload, _, signature = token.rpartition('.')
+        parts = payload.split('.')
+        if len(parts) != 5 or parts[0] not in self.keys:
+            return None
+        if not hmac.compare_digest(self._signature(parts[0], payload),
+                                   signature):
+            return None
+        try:
+            user_id = self._decode(parts[1])
+            exp = int(parts[3])
+        except ValueError:
+            return None
+        if exp < time.time():
+            return None
+        if parts[4] in self.revoked:
+            return None
+        return user_id, exp, parts[4]
+
+    def user_id_for_session_id(self, session_id: str = None) -> str:
+        """ Retrieve the user id of a valid token
+        """
+        claims = self.verify_token(session_id)
+        if claims is None:
+            return None
+        return claims[0]
+
+    def revoke(self, nonce: str, exp: int):
+        """ Add a token to the revocation list until it expires
+        """
+        self.revoked.add(nonce, exp)
+
+    def destroy_session(self, request=None) -> bool:
+        """ Destroy the session/Log out the current user
+        Return:
+            - True on successful logout
+            - False on error
+        """
+        if request is None:
+            return False
+        claims = self.verify_token(self.session_cookie(request))
+        if claims is None:
+            return False
+        self.revoke(claims[2], claims[1])
+        return True
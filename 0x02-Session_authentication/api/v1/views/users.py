@@ -1,19 +1,67 @@
 #!/usr/bin/env python3
 """ Module of Users views
 """
+from typing import Iterator
+import json
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import abort, jsonify, request, Response
 from models.user import User
 
 
+MAX_PAGE_SIZE = 1000
+STREAM_PAGE_SIZE = 500
+
+
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters:
+      - limit (optional): page size, users are ordered by id
+      - cursor (optional): id of the last User of the previous page
+      - stream (optional): stream the list while it is serialized
     Return:
       - list of all User objects JSON represented
+      - {"users": [...], "next_cursor": ...} if a limit is given
+      - 400 if the limit isn't a positive integer
+    """
+    cursor = request.args.get('cursor')
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        return Response(_stream_users(cursor), mimetype='application/json')
+    if request.args.get('limit') is None and cursor is None:
+        all_users = [user.to_json() for user in User.all()]
+        return jsonify(all_users)
+
+    try:
+        limit = int(request.args.get('limit', MAX_PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if limit <= 0:
+        return jsonify({'error': "Wrong limit"}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
+    users = User.page(limit, cursor)
+    next_cursor = users[-1].id if len(users) == limit else None
+    return jsonify({
+        'users': [user.to_json() for user in users],
+        'next_cursor': next_cursor
+    })
+
+
+def _stream_users(cursor: str = None) -> Iterator[str]:
+    """ Yield the JSON list of users in a single pass ordered by id,
+    STREAM_PAGE_SIZE users per chunk
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    yield '['
+    chunk = []
+    separator = ''
+    for user in User.scan(cursor):
+        chunk.append(user.to_json())
+        if len(chunk) >= STREAM_PAGE_SIZE:
+            yield separator + json.dumps(chunk)[1:-1]
+            chunk = []
+            separator = ','
+    if len(chunk) > 0:
+        yield separator + json.dumps(chunk)[1:-1]
+    yield ']'
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+""" Models package, the storage engine is selected by STORAGE_TYPE
+"""
+from os import getenv
+
+
+if getenv('STORAGE_TYPE') == 'sqlite':
+    from models.engine.sqlite_storage import SQLiteStorage
+    storage = SQLiteStorage()
+else:
+    from models.engine.json_storage import JSONStorage
+    storage = JSONStorage()
@@ -2,36 +2,44 @@
 """ Base module
 """
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
-import json
+from functools import lru_cache
+from typing import TypeVar, List, Iterable, Iterator, Tuple
 import uuid
+from models import storage
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
-DATA = {}
+FIELDS = {}
+
+
+@lru_cache(maxsize=256)
+def parse_timestamp(value: str) -> datetime:
+    """ Parse a serialized timestamp, sharing the (immutable) datetime
+    between the created_at/updated_at of a record and records stored in
+    the same second; the cache stays small so it keeps few of them alive
+    """
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
 
 
 class Base():
     """ Base class
+
+    Models declare their stored attributes in __slots__ so that no
+    per-instance __dict__ is allocated.
     """
+    __slots__ = ('id', 'created_at', 'updated_at')
+    indexed_attributes = ()
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
-        s_class = str(self.__class__.__name__)
-        if DATA.get(s_class) is None:
-            DATA[s_class] = {}
-
-        self.id = kwargs.get('id', str(uuid.uuid4()))
+        self.id = kwargs['id'] if 'id' in kwargs else str(uuid.uuid4())
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = parse_timestamp(kwargs.get('created_at'))
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = parse_timestamp(kwargs.get('updated_at'))
         else:
             self.updated_at = datetime.utcnow()
 
@@ -44,11 +52,22 @@ class Base():
             return False
         return (self.id == other.id)
 
+    def __setattr__(self, name: str, value):
+        """ Set an attribute, indexed ones go through the storage engine
+        """
+        if name in self.indexed_attributes:
+            storage.set_indexed(self, name, value)
+        else:
+            super().__setattr__(name, value)
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
         """
         result = {}
-        for key, value in self.__dict__.items():
+        values = [(key, getattr(self, key)) for key in self.fields()
+                  if hasattr(self, key)]
+        values.extend(getattr(self, '__dict__', {}).items())
+        for key, value in values:
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
@@ -58,80 +77,73 @@ class Base():
         return result
 
     @classmethod
-    def load_from_file(cls):
-        """ Load all objects from file
+    def fields(cls) -> Tuple[str, ...]:
+        """ Names of the slots of the class, base classes first
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
+        names = FIELDS.get(cls)
+        if names is None:
+            names = tuple(name for klass in reversed(cls.__mro__)
+                          for name in klass.__dict__.get('__slots__', ()))
+            FIELDS[cls] = names
+        return names
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def load_from_file(cls):
+        """ Load all objects from storage
+        """
+        storage.load(cls)
 
     @classmethod
     def save_to_file(cls):
-        """ Save all objects to file
+        """ Persist all objects to storage
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
-
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+        storage.dump(cls)
 
     def save(self):
         """ Save current object
         """
-        s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        storage.save(self)
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        storage.remove(self)
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
-        s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        return storage.count(cls)
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
         """ Return all objects
         """
-        return cls.search()
+        return storage.all(cls)
+
+    @classmethod
+    def page(cls, limit: int,
+             cursor: str = None) -> List[TypeVar('Base')]:
+        """ Return at most `limit` objects ordered by id, starting after
+        the `cursor` id
+        """
+        return storage.page(cls, limit, cursor)
+
+    @classmethod
+    def scan(cls, cursor: str = None) -> Iterator[TypeVar('Base')]:
+        """ Yield all objects ordered by id, starting after the `cursor` id
+        """
+        return storage.scan(cls, cursor)
 
     @classmethod
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        return storage.get(cls, id)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
         """
-        s_class = cls.__name__
-        def _search(obj):
-            if len(attributes) == 0:
-                return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
-                    return False
-            return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+        return storage.search(cls, attributes)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+""" Memory benchmark of the models
+
+Measures the RSS growth per object while building `count` User objects
+(distinct ids and timestamps) with the __slots__ models, and with the
+__dict__ based layout they replaced. Each layout runs in its own process:
+
+    $ python3 -m models.benchmark_memory [count] [slots|dict]
+"""
+from datetime import datetime, timedelta
+import gc
+import os
+import subprocess
+import sys
+import uuid
+from models.base import TIMESTAMP_FORMAT
+from models.user import User
+
+
+class DictUser():
+    """ User with the per-instance __dict__ layout used before __slots__
+    """
+
+    def __init__(self, *args: list, **kwargs: dict):
+        """ Initialize a DictUser instance
+        """
+        self.id = kwargs.get('id', str(uuid.uuid4()))
+        self.created_at = datetime.strptime(kwargs.get('created_at'),
+                                            TIMESTAMP_FORMAT)
+        self.updated_at = datetime.strptime(kwargs.get('updated_at'),
+                                            TIMESTAMP_FORMAT)
+        self.email = kwargs.get('email')
+        self._password = kwargs.get('_password')
+        self.first_name = kwargs.get('first_name')
+        self.last_name = kwargs.get('last_name')
+
+
+def rss() -> int:
+    """ Resident set size of the current process, in bytes
+    """
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def measure(cls, count: int) -> float:
+    """ RSS growth per object while building `count` objects of a class
+    """
+    start = datetime(2024, 1, 1)
+    # the cyclic GC would rescan every object built so far
+    gc.disable()
+    before = rss()
+    objs = []
+    for i in range(count):
+        timestamp = (start + timedelta(seconds=i)).strftime(TIMESTAMP_FORMAT)
+        objs.append(cls(id=str(uuid.uuid4()), created_at=timestamp,
+                        updated_at=timestamp,
+                        email='user{}@test.com'.format(i),
+                        _password='{:064x}'.format(i),
+                        first_name='first', last_name='last'))
+    growth = rss() - before
+    gc.enable()
+    return growth / count
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    if len(sys.argv) > 2:
+        cls = User if sys.argv[2] == 'slots' else DictUser
+        print("{:.0f}".format(measure(cls, count)))
+        sys.exit(0)
+
+    for variant in ('dict', 'slots'):
+        result = subprocess.run(
+            [sys.executable, '-m', 'models.benchmark_memory', str(count),
+             variant], capture_output=True, text=True, check=True)
+        print("{}: {} bytes/object ({} objects)".format(
+            variant, result.stdout.strip(), count))
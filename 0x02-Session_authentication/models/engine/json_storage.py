@@ -0,0 +1,580 @@
+#!/usr/bin/env python3
+""" Module of the JSON file storage engine
+"""
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from os import path, getenv
+from threading import Event, Lock, Thread
+from typing import Iterator, TypeVar, List, Tuple
+import atexit
+import json
+import mmap
+import os
+import re
+from models.engine.storage import Storage
+
+
+# the id at the start of a `"<id>": {...}` snapshot line
+_ID_PATTERN = re.compile(rb'\n("(?:[^"\\\n]+|\\.)*"): ')
+
+
+@lru_cache(maxsize=None)
+def _attribute_pattern(name: str):
+    """ Compiled pattern of the JSON value of a top-level key
+    """
+    return re.compile(rb'"' + re.escape(name.encode()) +
+                      rb'":\s*("(?:[^"\\]+|\\.)*"|[^,}\s]+)')
+
+
+def _decode(token: bytes):
+    """ Value of a JSON token, without the JSON parser for plain strings
+    """
+    if token[:1] == b'"' and b'\\' not in token:
+        return token[1:-1].decode()
+    return json.loads(token)
+
+
+class LazyObjects(dict):
+    """ Objects of a class keyed by id, backed by a memory-mapped snapshot
+
+    Loading only finds the ids and byte offsets of the records, in a single
+    regex pass over the snapshot, an object is parsed and built the first
+    time it is accessed. Values not yet hydrated are stored as (start, end)
+    offsets.
+    """
+
+    def __init__(self, cls, file_path: str):
+        """ Map the snapshot file and index the offset of each record
+        """
+        super().__init__()
+        self._cls = cls
+        self._lock = Lock()
+        with open(file_path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # snapshot order: record i spans _starts[i] to the ',\n' before
+        # the next record, or the '\n}' closing the file
+        self._ids = []
+        self._starts = []
+        ends = []
+        for match in _ID_PATTERN.finditer(self._map):
+            self._ids.append(_decode(match.group(1)))
+            self._starts.append(match.end())
+            ends.append(match.start() - 1)
+        if len(ends) > 0:
+            ends = ends[1:] + [self._map.rfind(b'\n}')]
+        dict.update(self, zip(self._ids, zip(self._starts, ends)))
+
+    @staticmethod
+    def can_map(file_path: str) -> bool:
+        """ Check if a snapshot file uses the one-record-per-line layout
+        """
+        with open(file_path, 'rb') as f:
+            return f.read(2) == b'{\n'
+
+    def raw(self, obj_id: str) -> str:
+        """ Return the JSON of an object without hydrating it
+        """
+        value = dict.get(self, obj_id)
+        if isinstance(value, tuple):
+            return self._map[value[0]:value[1]].decode()
+        return json.dumps(value.to_json(True))
+
+    def attribute_values(self, name: str) -> Iterator[Tuple[str, object]]:
+        """ Yield the (id, value) pairs of one attribute of all objects,
+        reading the records not hydrated yet in a single regex pass over
+        the snapshot (records are flat, so `"name":` only appears as a key)
+        """
+        pattern = _attribute_pattern(name)
+        tokens = pattern.findall(self._map)
+        if len(tokens) == len(self._ids):
+            # one value per record, in snapshot order
+            found = zip(self._ids, tokens)
+        else:
+            found = [(self._ids[bisect_right(self._starts, match.start()) - 1],
+                      match.group(1))
+                     for match in pattern.finditer(self._map)]
+            missing = set(self._ids).difference(
+                obj_id for obj_id, _ in found)
+            found.extend((obj_id, b'null') for obj_id in missing)
+        for obj_id, token in found:
+            # skip the records replaced or removed since the snapshot
+            if isinstance(dict.get(self, obj_id), tuple):
+                yield obj_id, _decode(token)
+        for obj_id, value in list(dict.items(self)):
+            if not isinstance(value, tuple):
+                yield obj_id, getattr(value, name, None)
+
+    def _hydrate(self, obj_id: str, value):
+        """ Build the object stored at some offsets, once
+        """
+        if not isinstance(value, tuple):
+            return value
+        with self._lock:
+            value = dict.get(self, obj_id)
+            if isinstance(value, tuple):
+                value = self._cls(
+                    **json.loads(self._map[value[0]:value[1]]))
+                dict.__setitem__(self, obj_id, value)
+        return value
+
+    def __getitem__(self, obj_id: str):
+        """ Get a hydrated object by id
+        """
+        return self._hydrate(obj_id, dict.__getitem__(self, obj_id))
+
+    def get(self, obj_id: str, default=None):
+        """ Get a hydrated object by id, or the default
+        """
+        if obj_id not in self:
+            return default
+        return self[obj_id]
+
+    def peek(self, obj_id: str, default=None):
+        """ Get an object by id, built for this call only if it isn't
+        hydrated yet, so that scans don't keep every object in memory
+        """
+        value = dict.get(self, obj_id)
+        if value is None:
+            return default
+        if isinstance(value, tuple):
+            return self._cls(**json.loads(self._map[value[0]:value[1]]))
+        return value
+
+    def pop(self, obj_id: str, *default):
+        """ Remove an object by id and return it hydrated
+        """
+        if obj_id not in self and len(default) > 0:
+            return default[0]
+        value = self[obj_id]
+        dict.pop(self, obj_id)
+        return value
+
+    def values(self) -> list:
+        """ Hydrate and return all objects
+        """
+        return [self[obj_id] for obj_id in list(self.keys())]
+
+    def items(self) -> list:
+        """ Hydrate and return all (id, object) pairs
+        """
+        return [(obj_id, self[obj_id]) for obj_id in list(self.keys())]
+
+
+class JSONStorage(Storage):
+    """ Storage of the objects in memory, persisted in one
+    `.db_<Class>.json` snapshot and one `.db_<Class>.journal` per class
+
+    With STORAGE_WRITE_BEHIND set, writes only mark their class dirty and
+    a background thread rewrites the snapshots of the dirty classes every
+    STORAGE_FLUSH_INTERVAL_MS or STORAGE_FLUSH_MUTATIONS writes.
+    STORAGE_FSYNC=always fsyncs every journal append and snapshot.
+    """
+
+    def __init__(self):
+        """ Initialise the in-memory tables from environment variables
+        """
+        self.data = {}
+        self.indexes = {}
+        self.sorted_ids = {}
+        self.journal_sizes = {}
+        try:
+            self.compact_threshold = int(
+                getenv('JOURNAL_COMPACT_THRESHOLD', '1000'))
+        except ValueError:
+            self.compact_threshold = 1000
+        self.lazy_load = getenv('STORAGE_LAZY_LOAD',
+                                '').lower() in ('1', 'true')
+        self.fsync = getenv('STORAGE_FSYNC', 'never') == 'always'
+        self.write_behind = getenv('STORAGE_WRITE_BEHIND',
+                                   '').lower() in ('1', 'true')
+        try:
+            self.flush_interval = int(
+                getenv('STORAGE_FLUSH_INTERVAL_MS', '200')) / 1000
+        except ValueError:
+            self.flush_interval = 0.2
+        try:
+            self.flush_mutations = int(
+                getenv('STORAGE_FLUSH_MUTATIONS', '1000'))
+        except ValueError:
+            self.flush_mutations = 1000
+        self.dirty = {}
+        self.mutations = 0
+        self._flush_lock = Lock()
+        self._dump_lock = Lock()
+        self._index_lock = Lock()
+        self._ids_lock = Lock()
+        self._wakeup = Event()
+        self._flusher = None
+
+    def objects(self, cls) -> dict:
+        """ Objects of a class keyed by id
+        """
+        s_class = cls.__name__
+        if self.data.get(s_class) is None:
+            self.data[s_class] = {}
+            self.rebuild_indexes(cls)
+        return self.data[s_class]
+
+    def load(self, cls):
+        """ Load all objects from the snapshot file, then replay the journal
+
+        With STORAGE_LAZY_LOAD set, the snapshot is memory-mapped and its
+        objects are only built on first access, as are its indexes.
+        """
+        s_class = cls.__name__
+        file_path = ".db_{}.json".format(s_class)
+        self.data[s_class] = {}
+        self.journal_sizes[s_class] = 0
+        self.sorted_ids.pop(s_class, None)
+        if path.exists(file_path):
+            if self.lazy_load and LazyObjects.can_map(file_path):
+                self.data[s_class] = LazyObjects(cls, file_path)
+            else:
+                with open(file_path, 'r') as f:
+                    objs_json = json.load(f)
+                    for obj_id, obj_json in objs_json.items():
+                        self.data[s_class][obj_id] = cls(**obj_json)
+        self.replay_journal(cls)
+        if isinstance(self.data[s_class], LazyObjects):
+            # built by the first search
+            self.indexes.pop(s_class, None)
+        else:
+            self.rebuild_indexes(cls)
+
+    def replay_journal(self, cls):
+        """ Apply the journal entries on top of the loaded snapshot
+        """
+        s_class = cls.__name__
+        objs = self.data[s_class]
+        journal_path = ".db_{}.journal".format(s_class)
+        if not path.exists(journal_path):
+            return
+        with open(journal_path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # torn write from a crash: keep what was replayed and
+                    # compact so later appends don't land after the tear
+                    self.dump(cls)
+                    return
+                if entry.get('op') == 'upsert':
+                    obj = cls(**entry['obj'])
+                    objs[obj.id] = obj
+                elif entry.get('op') == 'delete':
+                    if entry['id'] in objs:
+                        dict.pop(objs, entry['id'])
+                self.journal_sizes[s_class] += 1
+
+    def dump(self, cls):
+        """ Compact all objects into the snapshot file and reset the journal
+
+        The snapshot holds one record per line so it can be loaded lazily.
+        """
+        with self._dump_lock:
+            self._dump(cls)
+
+    def _dump(self, cls):
+        """ Write the snapshot of a class, the caller holds the dump lock
+        """
+        s_class = cls.__name__
+        file_path = ".db_{}.json".format(s_class)
+        objs = self.objects(cls)
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write('{')
+            separator = '\n'
+            for obj_id in list(objs.keys()):
+                if dict.get(objs, obj_id) is None:
+                    # removed by another thread while writing
+                    continue
+                if isinstance(objs, LazyObjects):
+                    obj_json = objs.raw(obj_id)
+                else:
+                    obj_json = json.dumps(objs[obj_id].to_json(True))
+                f.write('{}{}: {}'.format(separator, json.dumps(obj_id),
+                                          obj_json))
+                separator = ',\n'
+            f.write('\n}\n')
+            self._sync(f)
+        os.replace(tmp_path, file_path)
+        if self.fsync:
+            dir_fd = os.open(path.dirname(path.abspath(file_path)),
+                             os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        # replaying the old journal over the new snapshot is idempotent,
+        # so a crash before this truncation loses nothing
+        open(".db_{}.journal".format(s_class), 'w').close()
+        self.journal_sizes[s_class] = 0
+
+    def append_to_journal(self, cls, entry: dict):
+        """ Append one upsert/delete entry to the journal file
+        """
+        s_class = cls.__name__
+        line = json.dumps(entry) + "\n"
+        # under the dump lock, so an append never lands between a snapshot
+        # write and the journal truncation that follows it
+        with self._dump_lock:
+            with open(".db_{}.journal".format(s_class), 'a') as f:
+                f.write(line)
+                self._sync(f)
+            self.journal_sizes[s_class] = \
+                self.journal_sizes.get(s_class, 0) + 1
+            if self.journal_sizes[s_class] >= self.compact_threshold:
+                self._dump(cls)
+
+    def _sync(self, f):
+        """ Push a written file to disk if the fsync policy asks for it
+        """
+        if self.fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+    def mark_dirty(self, cls):
+        """ Schedule the snapshot of a class for the background flusher
+        """
+        with self._flush_lock:
+            self.dirty[cls.__name__] = cls
+            self.mutations += 1
+            if self._flusher is None:
+                self._flusher = Thread(target=self._flush_loop, daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+        if self.mutations >= self.flush_mutations:
+            self._wakeup.set()
+
+    def _flush_loop(self):
+        """ Flush the dirty classes forever, on a timer or on demand
+        """
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """ Rewrite the snapshots of the classes changed since last flush
+        """
+        with self._flush_lock:
+            dirty = self.dirty
+            self.dirty = {}
+            self.mutations = 0
+        for cls in dirty.values():
+            self.dump(cls)
+
+    def _persist(self, cls, entry: dict):
+        """ Journal a change, or leave it to the flusher in write-behind
+        """
+        if self.write_behind:
+            self.mark_dirty(cls)
+        else:
+            self.append_to_journal(cls, entry)
+
+    def save(self, obj: TypeVar('Base')):
+        """ Store an object and persist it
+        """
+        cls = obj.__class__
+        objs = self.objects(cls)
+        previous = objs.get(obj.id)
+        if previous is not obj:
+            if previous is not None:
+                self._unindex(previous)
+            objs[obj.id] = obj
+            self._reindex(obj)
+            if previous is None:
+                self._add_id(cls, obj.id)
+        self._persist(cls, {'op': 'upsert', 'obj': obj.to_json(True)})
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Drop an object and persist it
+        """
+        cls = obj.__class__
+        objs = self.objects(cls)
+        if objs.get(obj.id) is not None:
+            self._unindex(objs.pop(obj.id))
+            self._discard_id(cls, obj.id)
+            self._persist(cls, {'op': 'delete', 'id': obj.id})
+
+    def is_stored(self, obj: TypeVar('Base')) -> bool:
+        """ Check if this exact instance is the one held in storage
+        """
+        objs = self.data.get(obj.__class__.__name__, {})
+        # raw lookup: an object not hydrated yet can't be this instance
+        return dict.get(objs, getattr(obj, 'id', None)) is obj
+
+    def set_indexed(self, obj: TypeVar('Base'), name: str, value):
+        """ Set an indexed attribute, keeping its index in sync
+        """
+        with self._index_lock:
+            index = (self.indexes.get(obj.__class__.__name__) or {}).get(name)
+            if index is None or not self.is_stored(obj):
+                object.__setattr__(obj, name, value)
+                return
+            self._index_discard(index, getattr(obj, name, None), obj.id)
+            object.__setattr__(obj, name, value)
+            self._index_add(index, value, obj.id)
+
+    def rebuild_indexes(self, cls):
+        """ Rebuild all the declared attribute indexes from scratch
+        """
+        s_class = cls.__name__
+        indexes = {attr: {} for attr in cls.indexed_attributes}
+        with self._index_lock:
+            objs = self.data.get(s_class, {})
+            if isinstance(objs, LazyObjects):
+                # read from the mapped lines, without hydrating the objects
+                for attr, index in indexes.items():
+                    for obj_id, value in objs.attribute_values(attr):
+                        self._index_add(index, value, obj_id)
+            else:
+                for obj in objs.values():
+                    for attr, index in indexes.items():
+                        self._index_add(index, getattr(obj, attr, None),
+                                        obj.id)
+            self.indexes[s_class] = indexes
+
+    def _reindex(self, obj: TypeVar('Base')):
+        """ Add an object to every index of its class
+        """
+        with self._index_lock:
+            indexes = self.indexes.get(obj.__class__.__name__) or {}
+            for attr, index in indexes.items():
+                self._index_add(index, getattr(obj, attr, None), obj.id)
+
+    def _unindex(self, obj: TypeVar('Base')):
+        """ Drop an object from every index of its class
+        """
+        with self._index_lock:
+            indexes = self.indexes.get(obj.__class__.__name__) or {}
+            for attr, index in indexes.items():
+                self._index_discard(index, getattr(obj, attr, None), obj.id)
+
+    @staticmethod
+    def _index_add(index: dict, value, obj_id: str):
+        """ Add an object id to the bucket of a value
+        """
+        try:
+            index.setdefault(value, set()).add(obj_id)
+        except TypeError:
+            pass
+
+    @staticmethod
+    def _index_discard(index: dict, value, obj_id: str):
+        """ Remove an object id from the bucket of a value
+        """
+        try:
+            bucket = index.get(value)
+        except TypeError:
+            return
+        if bucket is None:
+            return
+        bucket.discard(obj_id)
+        if len(bucket) == 0:
+            del index[value]
+
+    def count(self, cls) -> int:
+        """ Count all objects of a class
+        """
+        return len(self.objects(cls))
+
+    def _add_id(self, cls, obj_id: str):
+        """ Insert a new id in the sorted ids of its class, unless they
+        were sorted after it was stored
+        """
+        with self._ids_lock:
+            ids = self.sorted_ids.get(cls.__name__)
+            if ids is not None:
+                i = bisect_left(ids, obj_id)
+                if i == len(ids) or ids[i] != obj_id:
+                    ids.insert(i, obj_id)
+
+    def _discard_id(self, cls, obj_id: str):
+        """ Remove an id from the sorted ids of its class
+        """
+        with self._ids_lock:
+            ids = self.sorted_ids.get(cls.__name__)
+            if ids is not None:
+                i = bisect_left(ids, obj_id)
+                if i < len(ids) and ids[i] == obj_id:
+                    del ids[i]
+
+    def ids_after(self, cls, cursor: str, limit: int) -> List[str]:
+        """ At most `limit` ids in order after the `cursor` id, from the
+        ids of the class sorted once and kept sorted by save and remove
+        """
+        s_class = cls.__name__
+        objs = self.objects(cls)
+        with self._ids_lock:
+            ids = self.sorted_ids.get(s_class)
+            if ids is None:
+                ids = sorted(objs.keys())
+                self.sorted_ids[s_class] = ids
+            start = 0 if cursor is None else bisect_right(ids, cursor)
+            return ids[start:start + limit]
+
+    def page(self, cls, limit: int,
+             cursor: str = None) -> List[TypeVar('Base')]:
+        """ Return at most `limit` objects ordered by id, starting after
+        the `cursor` id
+        """
+        objs = self.objects(cls)
+        return [obj for obj in map(objs.get, self.ids_after(cls, cursor,
+                                                            limit))
+                if obj is not None]
+
+    def scan(self, cls, cursor: str = None,
+             batch_size: int = 500) -> Iterator[TypeVar('Base')]:
+        """ Yield all objects ordered by id, after `cursor`, `batch_size`
+        ids at a time, without keeping lazily loaded objects hydrated
+        """
+        objs = self.objects(cls)
+        peek = objs.peek if isinstance(objs, LazyObjects) else objs.get
+        while True:
+            ids = self.ids_after(cls, cursor, batch_size)
+            for obj_id in ids:
+                obj = peek(obj_id)
+                if obj is not None:
+                    # skip the objects removed since the batch was taken
+                    yield obj
+            if len(ids) < batch_size:
+                return
+            cursor = ids[-1]
+
+    def get(self, cls, id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        return self.objects(cls).get(id)
+
+    def search(self, cls, attributes: dict) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes, narrowing the
+        candidates through an index when one of the attributes has one
+        """
+        s_class = cls.__name__
+        objs = self.objects(cls)
+        if self.indexes.get(s_class) is None and len(attributes) > 0:
+            self.rebuild_indexes(cls)
+        candidates = None
+        indexes = self.indexes.get(s_class) or {}
+        for k, v in attributes.items():
+            if k not in indexes:
+                continue
+            try:
+                bucket = list(indexes[k].get(v, ()))
+            except TypeError:
+                continue
+            # only the matching objects get hydrated
+            candidates = [obj for obj in map(objs.get, bucket)
+                          if obj is not None]
+            break
+        if candidates is None:
+            candidates = objs.values()
+
+        def _search(obj):
+            for k, v in attributes.items():
+                if (getattr(obj, k) != v):
+                    return False
+            return True
+
+        return list(filter(_search, candidates))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+""" Module of the SQLite storage engine
+"""
+from os import getenv, getpid
+from threading import local
+from typing import TypeVar, List
+import json
+import sqlite3
+from models.engine.storage import Storage
+
+
+class SQLiteStorage(Storage):
+    """ Storage of the objects in an embedded SQLite database
+
+    Each class gets a table with the object JSON, keyed by id, plus one
+    indexed column per attribute in its `indexed_attributes`.
+    """
+
+    def __init__(self):
+        """ Initialise the database path from environment variables
+        """
+        self.db_path = getenv('STORAGE_SQLITE_PATH', '.db.sqlite3')
+        self._local = local()
+        self._tables = set()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """ Connection of the current thread, opened in this process
+        """
+        pid = getpid()
+        con = getattr(self._local, 'connection', None)
+        if con is None or self._local.pid != pid:
+            # a connection inherited through fork must not be used
+            con = sqlite3.connect(self.db_path)
+            con.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = con
+            self._local.pid = pid
+        return con
+
+    def table(self, cls) -> str:
+        """ Create the table (and indexes) of a class if needed
+        """
+        s_class = cls.__name__
+        if s_class not in self._tables:
+            columns = ''.join(', "{}" TEXT'.format(attr)
+                              for attr in cls.indexed_attributes)
+            with self.connection as con:
+                con.execute('CREATE TABLE IF NOT EXISTS "{}" '
+                            '(id TEXT PRIMARY KEY, data TEXT NOT NULL{})'
+                            .format(s_class, columns))
+                for attr in cls.indexed_attributes:
+                    con.execute('CREATE INDEX IF NOT EXISTS "ix_{0}_{1}" '
+                                'ON "{0}" ("{1}")'.format(s_class, attr))
+            self._tables.add(s_class)
+        return s_class
+
+    @staticmethod
+    def _column_value(value):
+        """ Value stored in an indexed column
+        """
+        if value is None or type(value) in (str, int, float):
+            return value
+        return str(value)
+
+    def _build(self, cls, rows) -> List[TypeVar('Base')]:
+        """ Build objects from (data,) rows
+        """
+        return [cls(**json.loads(row[0])) for row in rows]
+
+    def load(self, cls):
+        """ Make sure the table of a class exists
+        """
+        self.table(cls)
+
+    def dump(self, cls):
+        """ Nothing to do, every write is committed on its own
+        """
+
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or update the row of an object
+        """
+        cls = obj.__class__
+        table = self.table(cls)
+        attrs = cls.indexed_attributes
+        columns = ''.join(', "{}"'.format(attr) for attr in attrs)
+        updates = ''.join(', "{0}" = excluded."{0}"'.format(attr)
+                          for attr in attrs)
+        values = [obj.id, json.dumps(obj.to_json(True))]
+        values.extend(self._column_value(getattr(obj, attr, None))
+                      for attr in attrs)
+        with self.connection as con:
+            con.execute('INSERT INTO "{}" (id, data{}) VALUES ({}) '
+                        'ON CONFLICT(id) DO UPDATE SET data = excluded.data{}'
+                        .format(table, columns,
+                                ', '.join('?' * len(values)), updates),
+                        values)
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete the row of an object
+        """
+        table = self.table(obj.__class__)
+        with self.connection as con:
+            con.execute('DELETE FROM "{}" WHERE id = ?'.format(table),
+                        (obj.id,))
+
+    def count(self, cls) -> int:
+        """ Count all objects of a class
+        """
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM "{}"'.format(self.table(cls))).fetchone()[0]
+
+    def page(self, cls, limit: int,
+             cursor: str = None) -> List[TypeVar('Base')]:
+        """ Return at most `limit` objects ordered by id, starting after
+        the `cursor` id
+        """
+        rows = self.connection.execute(
+            'SELECT data FROM "{}" WHERE id > ? ORDER BY id LIMIT ?'
+            .format(self.table(cls)), (cursor or '', limit))
+        return self._build(cls, rows)
+
+    def get(self, cls, id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        rows = self._build(cls, self.connection.execute(
+            'SELECT data FROM "{}" WHERE id = ?'.format(self.table(cls)),
+            (id,)))
+        return rows[0] if len(rows) > 0 else None
+
+    def search(self, cls, attributes: dict) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes, filtering in SQL
+        on the indexed ones
+        """
+        clauses = []
+        values = []
+        for k, v in attributes.items():
+            if k not in cls.indexed_attributes:
+                continue
+            if v is None:
+                clauses.append('"{}" IS NULL'.format(k))
+            else:
+                clauses.append('"{}" = ?'.format(k))
+                values.append(self._column_value(v))
+        query = 'SELECT data FROM "{}"'.format(self.table(cls))
+        if len(clauses) > 0:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        objs = self._build(cls, self.connection.execute(query, values))
+
+        def _search(obj):
+            for k, v in attributes.items():
+                if (getattr(obj, k) != v):
+                    return False
+            return True
+
+        return list(filter(_search, objs))
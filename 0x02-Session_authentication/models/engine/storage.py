@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+""" Module of the Base of storage engines
+"""
+from typing import Iterator, TypeVar, List
+
+
+class Storage:
+    """ Base storage engine class, every model operation goes through
+    one instance of it: `models.storage`
+    """
+    def load(self, cls):
+        """ Load all objects of a class
+        """
+        raise NotImplementedError
+
+    def dump(self, cls):
+        """ Persist all objects of a class
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """ Write out any change not persisted yet
+        """
+
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or update one object
+        """
+        raise NotImplementedError
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete one object
+        """
+        raise NotImplementedError
+
+    def count(self, cls) -> int:
+        """ Count all objects of a class
+        """
+        raise NotImplementedError
+
+    def all(self, cls) -> List[TypeVar('Base')]:
+        """ Return all objects of a class
+        """
+        return self.search(cls, {})
+
+    def page(self, cls, limit: int,
+             cursor: str = None) -> List[TypeVar('Base')]:
+        """ Return at most `limit` objects ordered by id, after `cursor`
+        """
+        raise NotImplementedError
+
+    def scan(self, cls, cursor: str = None,
+             batch_size: int = 500) -> Iterator[TypeVar('Base')]:
+        """ Yield all objects ordered by id, after `cursor`, fetching them
+        `batch_size` at a time
+        """
+        while True:
+            objs = self.page(cls, batch_size, cursor)
+            yield from objs
+            if len(objs) < batch_size:
+                return
+            cursor = objs[-1].id
+
+    def get(self, cls, id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        raise NotImplementedError
+
+    def search(self, cls, attributes: dict) -> List[TypeVar('Base')]:
+        """ Return all objects with matching attributes
+        """
+        raise NotImplementedError
+
+    def set_indexed(self, obj: TypeVar('Base'), name: str, value):
+        """ Set an indexed attribute of an object
+        """
+        object.__setattr__(obj, name, value)
@@ -1,12 +1,25 @@
 #!/usr/bin/env python3
 """App module
 """
+from os import getenv
 from flask import Flask, jsonify, request, abort, redirect
-from auth import Auth
+from auth import Auth, BCRYPT_POOL, bcrypt_rounds, in_main_process
 
 
-AUTH = Auth()
 app = Flask(__name__)
+if in_main_process():
+    # bcrypt workers import this module again, without the database
+    AUTH = Auth()
+    # calibrate before serving, not in the first request
+    bcrypt_rounds()
+    BCRYPT_POOL.start()
+
+
+@app.teardown_appcontext
+def teardown_db(exception=None):
+    """Release the database session at the end of each request
+    """
+    AUTH.teardown()
 
 
 @app.route('/', methods=['GET'])
@@ -28,6 +41,8 @@ def users():
         return jsonify({"email": email, "message": "user created"})
     except ValueError:
         return jsonify({"message": "email already registered"}), 400
+    except TimeoutError:
+        abort(503)
 
 
 @app.route('/sessions', methods=['POST'])
@@ -37,8 +52,11 @@ def login():
     email = request.form.get("email")
     password = request.form.get("password")
 
-    if not AUTH.valid_login(email, password):
-        abort(401)
+    try:
+        if not AUTH.valid_login(email, password):
+            abort(401)
+    except TimeoutError:
+        abort(503)
     session_id = AUTH.create_session(email)
     response = jsonify({"email": email, "message": "logged in"})
     response.set_cookie("session_id", session_id)
@@ -95,4 +113,6 @@ def update_password():
 
 
 if __name__ == "__main__":
+    if getenv('AUTH_DB_RESET') == '1':
+        AUTH.reset()
     app.run(host="0.0.0.0", port="5000")
@@ -1,9 +1,18 @@
 #!/usr/bin/env python3
 """Auth module
 """
-from typing import Union
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from os import cpu_count, getenv
+from threading import BoundedSemaphore, Lock
+from typing import Callable, Union
 import bcrypt
 import base64 as b64
+import logging
+import multiprocessing
+import time
 from uuid import uuid4
 from sqlalchemy.orm.exc import NoResultFound
 
@@ -11,10 +20,213 @@ from db import DB
 from user import User
 
 
+BCRYPT_ROUNDS_FLOOR = 10
+logger = logging.getLogger(__name__)
+
+
+def calibrate_bcrypt_rounds(target_ms: float = 250,
+                            min_rounds: int = BCRYPT_ROUNDS_FLOOR,
+                            max_rounds: int = 16) -> int:
+    """Find the highest bcrypt work factor hashing within `target_ms`
+    milliseconds on this host, never below `min_rounds`
+    """
+    rounds = min_rounds
+    while rounds < max_rounds:
+        start = time.perf_counter()
+        bcrypt.hashpw(b'calibration', bcrypt.gensalt(rounds))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        # every extra round doubles the hashing time
+        if elapsed_ms * 2 > target_ms:
+            break
+        rounds += 1
+    return rounds
+
+
+@lru_cache(maxsize=None)
+def bcrypt_rounds() -> int:
+    """Work factor of new hashes: BCRYPT_ROUNDS, or calibrated once
+    against BCRYPT_TARGET_MS and at least BCRYPT_MIN_ROUNDS, never
+    below 10
+    """
+    if getenv('BCRYPT_ROUNDS'):
+        # an explicit setting only has to clear the floor
+        min_rounds = BCRYPT_ROUNDS_FLOOR
+        rounds = int(getenv('BCRYPT_ROUNDS'))
+    else:
+        min_rounds = max(BCRYPT_ROUNDS_FLOOR,
+                         int(getenv('BCRYPT_MIN_ROUNDS', '10')))
+        rounds = calibrate_bcrypt_rounds(
+            float(getenv('BCRYPT_TARGET_MS', '250')), min_rounds)
+    if rounds < min_rounds:
+        logger.warning('bcrypt work factor %d raised to the minimum %d',
+                       rounds, min_rounds)
+        rounds = min_rounds
+    logger.info('bcrypt work factor: %d', rounds)
+    return rounds
+
+
+def _bcrypt_hash_rounds(hashed_password: bytes) -> int:
+    """Work factor of a '$2b$<rounds>$...' bcrypt hash
+    """
+    try:
+        return int(hashed_password.split(b'$')[2])
+    except (IndexError, ValueError):
+        return 0
+
+
+def in_main_process() -> bool:
+    """Check that this isn't a worker process, which imports the main
+    module again when it starts
+    """
+    return multiprocessing.current_process().name == 'MainProcess'
+
+
+def _bcrypt_hashpw(password: bytes, rounds: int) -> bytes:
+    """Hash a password with a new salt, run in a bcrypt worker process
+    """
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _bcrypt_checkpw(password: bytes, hashed_password: bytes) -> bool:
+    """Check a password against its hash, run in a bcrypt worker process
+    """
+    return bcrypt.checkpw(password, hashed_password)
+
+
+def _bcrypt_noop() -> None:
+    """Empty job, run once per worker to start it
+    """
+
+
+class BcryptPool:
+    """Process pool running bcrypt off the request threads
+
+    At most `max_pending` jobs are queued or running, submitting more
+    waits up to `timeout` seconds for a slot. With 0 workers the jobs run
+    inline in the calling thread. Workers are started with `start_method`
+    (forkserver where available), never forked from a threaded server,
+    and the pool is started again if a worker dies. Each worker imports
+    the main module again, whose startup code must only run when
+    `in_main_process()`.
+    """
+
+    def __init__(self, workers: int = None, max_pending: int = 64,
+                 timeout: float = 5.0, start_method: str = None):
+        """Initialise the pool settings, the processes start with `start`
+        """
+        if start_method is None:
+            start_method = ('forkserver' if 'forkserver' in
+                            multiprocessing.get_all_start_methods()
+                            else 'spawn')
+        self.workers = workers
+        self.timeout = timeout
+        self.start_method = start_method
+        self._slots = BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = Lock()
+
+    def start(self) -> None:
+        """Start the worker processes, at app startup, and wait until
+        they all run
+        """
+        if self.workers == 0:
+            return
+        executor = self._get_executor()
+        # the executor only spawns a worker when a job finds none idle
+        futures = [executor.submit(_bcrypt_noop)
+                   for _ in range(self.workers or cpu_count() or 1)]
+        for future in futures:
+            future.result()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Running process pool, started if needed
+        """
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context(self.start_method)
+                if self.start_method == 'forkserver':
+                    # bcrypt is imported once in the fork server
+                    context.set_forkserver_preload([__name__])
+                self._executor = ProcessPoolExecutor(self.workers,
+                                                     mp_context=context)
+            return self._executor
+
+    def _reset(self, executor: ProcessPoolExecutor) -> None:
+        """Drop a broken process pool, the next job starts a new one
+        """
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Queue a bcrypt job and return its future
+        """
+        if self.workers == 0:
+            future = Future()
+            future.set_result(fn(*args))
+            return future
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError('Too many pending bcrypt jobs')
+        try:
+            executor = self._get_executor()
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                self._reset(executor)
+                executor = self._get_executor()
+                future = executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        def _done(future: Future) -> None:
+            self._slots.release()
+            if (not future.cancelled() and
+                    isinstance(future.exception(), BrokenProcessPool)):
+                # this job is lost, the following ones get a new pool
+                self._reset(executor)
+
+        future.add_done_callback(_done)
+        return future
+
+    def result(self, future: Future):
+        """Wait for the result of a job, at most `timeout` seconds
+        """
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            raise TimeoutError('bcrypt job timed out')
+        except BrokenProcessPool:
+            raise TimeoutError('bcrypt worker died')
+
+    def shutdown(self) -> None:
+        """Stop the worker processes
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+BCRYPT_POOL = BcryptPool(
+    int(getenv('BCRYPT_WORKERS')) if getenv('BCRYPT_WORKERS') else None,
+    int(getenv('BCRYPT_MAX_PENDING', '64')),
+    float(getenv('BCRYPT_TIMEOUT', '5')),
+    getenv('BCRYPT_START_METHOD') or None)
+
+
+def _hash_password_async(password: str) -> Future:
+    """Hash the input password with some salt on the bcrypt pool
+    """
+    return BCRYPT_POOL.submit(_bcrypt_hashpw, password.encode(),
+                              bcrypt_rounds())
+
+
 def _hash_password(password: str) -> bytes:
     """Hash the input password with some salt
     """
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    return BCRYPT_POOL.result(_hash_password_async(password))
 
 
 def _generate_uuid() -> str:
@@ -32,38 +244,65 @@ class Auth:
         """
         self._db = DB()
 
+    def teardown(self) -> None:
+        """Release the database session of the current request
+        """
+        self._db.remove_session()
+
+    def reset(self) -> None:
+        """Delete all the users, at the startup of the main process only
+        """
+        self._db.reset()
+
     def register_user(self, email: str, password: str) -> User:
-        """Register a new user with an email + password
+        """Register a new user with an email + password, in a single
+        insert relying on the unique email constraint
+        """
+        return self._db.add_user(
+            email, b64.b64encode(_hash_password(password)).decode())
+
+    def valid_login_async(self, email: str, password: str) -> Future:
+        """Check if login info is valid on the bcrypt pool
         """
         try:
-            duplicate_user = self._db.find_user_by(email=email)
-            raise ValueError(f'User {email} already exists')
+            user = self._db.find_user_by(email=email)
         except NoResultFound:
-            return self._db.add_user(
-                email,
-                b64.b64encode(_hash_password(password)).decode())
+            future = Future()
+            future.set_result(False)
+            return future
+        return BCRYPT_POOL.submit(
+            _bcrypt_checkpw, password.encode(),
+            b64.b64decode(user.hashed_password.encode()))
 
     def valid_login(self, email: str, password: str) -> bool:
-        """Check if login info is valid
+        """Check if login info is valid, rehashing the password on success
+        if it was hashed with an outdated work factor
         """
         try:
             user = self._db.find_user_by(email=email)
-            return bcrypt.checkpw(
-                password.encode(),
-                b64.b64decode(user.hashed_password.encode()))
         except NoResultFound:
             return False
+        hashed_password = b64.b64decode(user.hashed_password.encode())
+        if not BCRYPT_POOL.result(BCRYPT_POOL.submit(
+                _bcrypt_checkpw, password.encode(), hashed_password)):
+            return False
+        if _bcrypt_hash_rounds(hashed_password) < bcrypt_rounds():
+            self._db.update_user(
+                user.id,
+                hashed_password=b64.b64encode(
+                    _hash_password(password)).decode())
+        return True
 
     def create_session(self, email: str) -> str:
         """Create a new session for a user
         """
         try:
             user = self._db.find_user_by(email=email)
-            session_id = _generate_uuid()
-            user.session_id = session_id
-            return session_id
         except NoResultFound:
             return None
+        session_id = _generate_uuid()
+        self._db.update_user(user.id, session_id=session_id)
+        return session_id
 
     def get_user_from_session_id(self, session_id: str) -> Union[User, None]:
         """Get the user associated with a specific session_id
@@ -79,20 +318,20 @@ class Auth:
         """Destroy the session for the specific user
         """
         try:
-            user = self._db.find_user_by(id=user_id)
-            user.session_id = None
-            return None
+            self._db.update_user(user_id, session_id=None)
         except NoResultFound:
-            return None
+            pass
+        return None
 
     def get_reset_password_token(self, email: str) -> str:
         """Create a password reset token
         """
-        user = self._db.find_user_by(email=email)
-        if user is None:
+        try:
+            user = self._db.find_user_by(email=email)
+        except NoResultFound:
             raise ValueError
         reset_token = _generate_uuid()
-        user.reset_token = reset_token
+        self._db.update_user(user.id, reset_token=reset_token)
         return reset_token
 
     def update_password(self, reset_token: str, password: str) -> None:
@@ -100,11 +339,14 @@ class Auth:
         """
         if reset_token is None:
             raise ValueError
-        user = self._db.find_user_by(reset_token=reset_token)
-        if user is None:
+        try:
+            user = self._db.find_user_by(reset_token=reset_token)
+        except NoResultFound:
             raise ValueError
-        user.hashed_password = b64.b64encode(_hash_password(password)).decode()
-        user.reset_token = None
+        self._db.update_user(
+            user.id,
+            hashed_password=b64.b64encode(_hash_password(password)).decode(),
+            reset_token=None)
 
 
 if __name__ == '__main__':
@@ -1,41 +1,107 @@
 #!/usr/bin/env python3
 """DB module
 """
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from os import getenv
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
 from sqlalchemy.orm.session import Session
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.exc import InvalidRequestError, IntegrityError
 
 from user import Base, User
 
 
+def sqlite_pragmas() -> dict:
+    """SQLite pragmas set on every new connection, from SQLITE_<PRAGMA>
+    environment variables
+    """
+    return {
+        'journal_mode': getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'mmap_size': getenv('SQLITE_MMAP_SIZE', '268435456'),
+        'cache_size': getenv('SQLITE_CACHE_SIZE', '-65536'),
+        'busy_timeout': getenv('SQLITE_BUSY_TIMEOUT', '5000'),
+    }
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """Apply the configured pragmas to a new SQLite connection
+    """
+    cursor = dbapi_connection.cursor()
+    for name, value in sqlite_pragmas().items():
+        if value:
+            cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
+
+
 class DB:
     """DB class
+
+    Sessions are scoped to the current thread, and released with
+    `remove_session` at the end of each request.
     """
-    def __init__(self) -> None:
-        """Initialize a new DB instance
+    def __init__(self, url: str = None) -> None:
+        """Initialize a new DB instance on `url`, AUTH_DB_URL by default,
+        creating the missing tables and indexes
         """
-        self._engine = create_engine("sqlite:///a.db")
-        Base.metadata.drop_all(self._engine)
+        if url is None:
+            url = getenv('AUTH_DB_URL', 'sqlite:///a.db')
+        if url in ('sqlite://', 'sqlite:///:memory:'):
+            # a single shared connection keeps the in-memory database alive
+            self._engine = create_engine(
+                url,
+                connect_args={'check_same_thread': False},
+                poolclass=StaticPool)
+        else:
+            self._engine = create_engine(
+                url,
+                connect_args=({'check_same_thread': False}
+                              if url.startswith('sqlite') else {}),
+                poolclass=QueuePool,
+                pool_size=int(getenv('DB_POOL_SIZE', '5')),
+                max_overflow=int(getenv('DB_MAX_OVERFLOW', '10')),
+                pool_timeout=float(getenv('DB_POOL_TIMEOUT', '30')),
+                pool_pre_ping=True)
+        if self._engine.dialect.name == 'sqlite':
+            event.listen(self._engine, 'connect', _set_sqlite_pragmas)
         Base.metadata.create_all(self._engine)
-        self.__session = None
+        for table in Base.metadata.sorted_tables:
+            # tables created before their indexes were declared
+            for index in table.indexes:
+                index.create(self._engine, checkfirst=True)
+        self.__session = scoped_session(sessionmaker(bind=self._engine))
 
     @property
     def _session(self) -> Session:
-        """Memoized session object
+        """Session object of the current thread
         """
-        if self.__session is None:
-            DBSession = sessionmaker(bind=self._engine)
-            self.__session = DBSession()
-        return self.__session
+        return self.__session()
+
+    def remove_session(self) -> None:
+        """Close the session of the current thread, returning its
+        connection to the pool
+        """
+        self.__session.remove()
+
+    def reset(self) -> None:
+        """Drop and create again all the tables, deleting every user
+        """
+        self.remove_session()
+        Base.metadata.drop_all(self._engine)
+        Base.metadata.create_all(self._engine)
 
     def add_user(self, email: str, hashed_password: str) -> User:
-        """Add a new user to the db
+        """Add a new user to the db, raise a ValueError if the email is
+        already registered
         """
         user = User(email=email, hashed_password=hashed_password)
         self._session.add(user)
-        self._save()
+        try:
+            self._save()
+        except IntegrityError:
+            self._session.rollback()
+            raise ValueError(f'User {email} already exists')
         return user
 
     def find_user_by(self, **kwargs) -> User:
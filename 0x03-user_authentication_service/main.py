@@ -41,6 +41,7 @@ def profile_logged(session_id: str) -> None:
     """
     response = rs.get("http://localhost:5000/profile",
                       cookies={'session_id': session_id})
+    assert response.status_code == 200
     assert 'email' in response.json()
 
 
@@ -86,4 +87,7 @@ if __name__ == "__main__":
     log_out(session_id)
     reset_token = reset_password_token(EMAIL)
     update_password(EMAIL, reset_token, NEW_PASSWD)
-    log_in(EMAIL, NEW_PASSWD)
+    # every write above is committed before the request ends
+    log_in_wrong_password(EMAIL, PASSWD)
+    session_id = log_in(EMAIL, NEW_PASSWD)
+    profile_logged(session_id)
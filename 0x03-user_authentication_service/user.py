@@ -14,10 +14,10 @@ class User(Base):
     __tablename__ = 'users'
 
     id = Column(INTEGER, primary_key=True)
-    email = Column(VARCHAR(250), nullable=False)
+    email = Column(VARCHAR(250), nullable=False, unique=True, index=True)
     hashed_password = Column(VARCHAR(250), nullable=False)
-    session_id = Column(VARCHAR(250), nullable=True)
-    reset_token = Column(VARCHAR(250), nullable=True)
+    session_id = Column(VARCHAR(250), nullable=True, index=True)
+    reset_token = Column(VARCHAR(250), nullable=True, index=True)
 
 
 if __name__ == '__main__':